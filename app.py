@@ -1,9 +1,19 @@
 import os
+import uuid
 import streamlit as st
 import gemini_experimental  # Import our Gemini module
 import utils  # Import our utility module
 import video_generation  # Import our video generation module
 import ui_components      # Import our new UI components module
+import image_store        # Import our content-addressed image store
+import file_uploads       # Import our Files API upload cache
+import artifact_store     # Import our managed temp-file store
+import response_cache     # Import our Gemini response cache
+import hedging            # Import our hedged-request policy
+import metrics            # Import our latency/counter metrics
+import media_server       # Import our static media server
+import session_store      # Import our persistent session store
+import contents_builder   # Import our incremental request builder
 
 # Load environment variables - make it optional
 try:
@@ -19,6 +29,12 @@ if not gemini_api_key:
     st.error("GEMINI_API_KEY environment variable is not set!")
     st.stop()
 
+# Expose /metrics when METRICS_ENABLED and METRICS_PORT are set (once per process)
+metrics.start_http_server()
+
+# Serve generated images and videos by URL when MEDIA_SERVER is set (once per process)
+media_server.get_media_server()
+
 # Set page config
 st.set_page_config(
     page_title="Gemini Image Chat",
@@ -26,47 +42,159 @@ st.set_page_config(
     layout="wide"
 )
 
-# Create temp directory in the root folder for storing generated files
+# Identifies this browser session to process-wide services (e.g. the video job queue).
+# With a session store, the id is kept in the URL (?session=...) so a reload, or a
+# request routed to another replica, resumes the same conversation.
+if "session_id" not in st.session_state:
+    store = session_store.get_session_store()
+    requested_id = st.query_params.get("session")
+    resumed = (store is not None and session_store.is_valid_session_id(requested_id)
+               and store.session_exists(requested_id))
+    st.session_state.session_id = requested_id if resumed else uuid.uuid4().hex
+    # A new session is only written to the store once it has something to keep
+    st.session_state.session_handle = (
+        session_store.SessionHandle(store, st.session_state.session_id, exists=resumed) if store is not None else None
+    )
+    if store is not None:
+        st.query_params["session"] = st.session_state.session_id
+session_handle = st.session_state.get("session_handle")
+
+# Per-session directory in the managed artifact store for generated files. Its name
+# appears in media URLs, so it is a fresh random name rather than the session id,
+# which is enough to resume the conversation.
 if "temp_dir" not in st.session_state:
-    st.session_state.temp_dir = utils.ensure_temp_dir()
+    st.session_state.temp_dir = artifact_store.get_artifact_store().session_dir(uuid.uuid4().hex)
 
-# Initialize session state for chat history and images
+# Initialize session state for chat history and images; a resumed session loads
+# only its recent messages, older ones are read on demand by the chat tab
 if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-if "images" not in st.session_state:
-    st.session_state.images = []
-
-if "generated_images" not in st.session_state:
-    st.session_state.generated_images = []
+    if session_handle is not None:
+        st.session_state.messages, st.session_state.history_start_seq = session_handle.load_messages()
+    else:
+        st.session_state.messages = []
+
+# Content-addressed store for uploaded and generated images
+if "image_store" not in st.session_state:
+    st.session_state.image_store = image_store.ImageStore(
+        on_change=session_handle.image_changed if session_handle is not None else None
+    )
+    if session_handle is not None:
+        st.session_state.image_store.restore(session_handle.load_images())
 
 if "video_generation_state" not in st.session_state:
     st.session_state.video_generation_state = video_generation.reset_video_state()
+    if session_handle is not None:
+        st.session_state.video_generation_state.update(
+            session_handle.load_state("video_generation_state", st.session_state.video_generation_state)
+        )
 
 # Session state for text-to-video generation
 if "text_video_prompt" not in st.session_state:
-    st.session_state.text_video_prompt = ""
-if "text_video_path" not in st.session_state:
-    st.session_state.text_video_path = None
+    st.session_state.text_video_prompt = session_handle.load_state("text_video_prompt", "") if session_handle is not None else ""
 if "text_video_error" not in st.session_state:
     st.session_state.text_video_error = None
-if "text_video_generating" not in st.session_state:
-    st.session_state.text_video_generating = False
+
+# Budget for the chat history sent with each request (see history_planner.py)
+HISTORY_BUDGET = {
+    "image_policy": os.environ.get("HISTORY_IMAGE_POLICY", "latest"),
+    "summarize": True,
+}
+
+# Optionally upload images once through the Gemini Files API and reference them by URI
+USE_FILES_API = os.environ.get("GEMINI_USE_FILES_API", "").lower() in ("1", "true", "yes")
+file_cache = file_uploads.get_file_cache(gemini_api_key) if USE_FILES_API else None
+
+# Builds each request from the contents of earlier turns plus the new one;
+# GEMINI_IMAGE_ATTACH decides which turns carry the uploaded images
+if "contents_builder" not in st.session_state:
+    st.session_state.contents_builder = contents_builder.ContentsBuilder(
+        image_part=file_cache.part_for if file_cache is not None else contents_builder.inline_image_part
+    )
+
+# Optional cache of Gemini responses keyed on prompt, history and image hashes
+USE_RESPONSE_CACHE = os.environ.get("GEMINI_RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+response_cache_instance = response_cache.get_response_cache() if USE_RESPONSE_CACHE else None
+
+# Optionally send a duplicate request when the first chunk is slower than usual
+USE_HEDGING = os.environ.get("GEMINI_HEDGING", "").lower() in ("1", "true", "yes")
+hedge_policy = hedging.get_hedge_policy() if USE_HEDGING else None
 
 def save_binary_file(data, mime_type):
     """Save binary data to a file with a unique name based on mime type in the temp directory"""
     return utils.save_binary_file(data, mime_type, st.session_state.temp_dir)
 
+def request_messages():
+    """Return the whole conversation for the model
+
+    A resumed session holds only its recent messages for display. The older
+    ones are read from the session store (again only after "Load older
+    messages" moves the start) and put in front, so the history planner
+    fits every turn into the budget instead of the request losing them.
+    """
+    messages = st.session_state.messages
+    start_seq = st.session_state.get("history_start_seq")
+    if session_handle is None or not start_seq or start_seq <= 1:
+        return messages
+    unloaded = st.session_state.get("unloaded_history")
+    if unloaded is None or unloaded["before_seq"] != start_seq:
+        older, _ = session_handle.load_messages(before_seq=start_seq, limit=None)
+        unloaded = st.session_state.unloaded_history = {"before_seq": start_seq, "messages": older}
+    return unloaded["messages"] + messages
+
 def generate_response(prompt):
     """Generate a response from Gemini model using our module"""
     # Call the function from our module
     return gemini_experimental.generate_response(
         gemini_api_key=gemini_api_key,
         prompt=prompt,
-        messages=st.session_state.messages,
-        images=st.session_state.images
+        messages=request_messages(),
+        images=st.session_state.image_store.uploaded(),
+        history_budget=HISTORY_BUDGET,
+        file_cache=file_cache,
+        cache=response_cache_instance,
+        bypass_cache=st.session_state.get("bypass_response_cache", False),
+        hedge=hedge_policy,
+        builder=st.session_state.contents_builder
+    )
+
+def stream_response(prompt):
+    """Stream a response from Gemini model as typed events using our module"""
+    return gemini_experimental.stream_response(
+        gemini_api_key=gemini_api_key,
+        prompt=prompt,
+        messages=request_messages(),
+        images=st.session_state.image_store.uploaded(),
+        history_budget=HISTORY_BUDGET,
+        file_cache=file_cache,
+        cache=response_cache_instance,
+        bypass_cache=st.session_state.get("bypass_response_cache", False),
+        hedge=hedge_policy,
+        builder=st.session_state.contents_builder
     )
 
+def variant_generator(prompt):
+    """Return a function generating one variant of the reply to prompt
+
+    The returned function runs on worker threads, so everything it needs
+    from session state is captured here. Variants skip the response cache
+    (they would all be the same answer) and hedging (they already run in
+    parallel).
+    """
+    messages = list(request_messages())
+    images = st.session_state.image_store.uploaded()
+    builder = st.session_state.contents_builder
+
+    def generate(index):
+        return gemini_experimental.generate_response(
+            gemini_api_key=gemini_api_key,
+            prompt=prompt,
+            messages=messages,
+            images=images,
+            history_budget=HISTORY_BUDGET,
+            file_cache=file_cache,
+            builder=builder
+        )
+    return generate
 
 # App UI
 st.title("Image Chat")
@@ -81,15 +209,15 @@ tab1, tab2 = st.tabs(["Image Chat", "Video Generation"])
 
 with tab1:
     st.header("Chat")
-    chat_container = st.container()
-    input_container = st.container()
+    # The chat tab is a fragment and creates its own containers
     ui_components.render_chat_tab(
         st_session_state=st.session_state,
         gemini_api_key_param=gemini_api_key, 
         save_binary_file_func=save_binary_file, 
         generate_response_func=generate_response, 
-        chat_container=chat_container,
-        input_container=input_container
+        stream_response_func=stream_response,
+        response_cache_enabled=USE_RESPONSE_CACHE,
+        variant_generator_func=variant_generator
     )
 
 with tab2:
@@ -0,0 +1,263 @@
+import os
+import re
+import threading
+import time
+
+# Defaults for the process-wide store; override via environment variables
+DEFAULT_QUOTA_BYTES = int(os.environ.get("ARTIFACT_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_SECONDS", str(24 * 60 * 60)))
+DEFAULT_SWEEP_INTERVAL = int(os.environ.get("ARTIFACT_SWEEP_INTERVAL", "300"))
+
+PARTIAL_SUFFIX = ".part"
+
+_SAFE_NAMESPACE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class ArtifactStore:
+    """Managed directory for generated images and videos
+
+    Files live in per-session subdirectories of ``root``. The store tracks
+    every file's size and last access, keeps total usage under
+    ``quota_bytes`` by evicting the least recently used files, and deletes
+    files not accessed for ``ttl_seconds``. A background sweeper applies the
+    TTL periodically; ``cleanup_orphans`` removes leftovers from earlier runs.
+    """
+
+    def __init__(self, root, quota_bytes=DEFAULT_QUOTA_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL, clock=time.time):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._files = {}
+        self._bytes = 0
+        self._sweeper = None
+        self._stop = threading.Event()
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.orphans_removed = 0
+        self.last_sweep = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def session_dir(self, session_id):
+        """Return (and create) the directory for a session's artifacts
+
+        Args:
+            session_id (str): Session namespace; letters, digits, "-" and "_" only
+
+        Returns:
+            str: Absolute directory path
+        """
+        if not _SAFE_NAMESPACE.match(session_id or ""):
+            raise ValueError(f"Invalid artifact namespace: {session_id!r}")
+        path = os.path.join(self.root, session_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _owns(self, path):
+        path = os.path.abspath(path)
+        return os.path.dirname(os.path.dirname(path)) == self.root, path
+
+    def register(self, path):
+        """Start tracking a file written into a session directory
+
+        Files outside the store are ignored. May evict other files to stay under quota.
+
+        Args:
+            path (str): Path of the finished file
+        """
+        owned, path = self._owns(path)
+        if not owned or not os.path.isfile(path):
+            return
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._files.get(path)
+            if old:
+                self._bytes -= old["size"]
+            self._files[path] = {"size": size, "last_access": self._clock()}
+            self._bytes += size
+        self.enforce_quota(keep=path)
+
+    def touch(self, path):
+        """Mark a file as recently used"""
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry:
+                entry["last_access"] = self._clock()
+
+    def exists(self, path):
+        """Return True if the file is still present (it may have been evicted)"""
+        return bool(path) and os.path.isfile(path)
+
+    def _delete(self, path):
+        """Remove a tracked file; caller must hold the lock"""
+        entry = self._files.pop(path, None)
+        if entry is None:
+            return 0
+        self._bytes -= entry["size"]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.evictions += 1
+        self.evicted_bytes += entry["size"]
+        return entry["size"]
+
+    def enforce_quota(self, keep=None):
+        """Evict least recently used files until usage fits the quota
+
+        Args:
+            keep (str, optional): Path that must not be evicted (e.g. the file just written)
+
+        Returns:
+            int: Bytes freed
+        """
+        freed = 0
+        with self._lock:
+            if self._bytes <= self.quota_bytes:
+                return 0
+            for path, _ in sorted(self._files.items(), key=lambda item: item[1]["last_access"]):
+                if self._bytes <= self.quota_bytes:
+                    break
+                if path != keep:
+                    freed += self._delete(path)
+        return freed
+
+    def sweep(self):
+        """Delete files past their TTL, then enforce the quota
+
+        Returns:
+            int: Bytes freed
+        """
+        now = self._clock()
+        freed = 0
+        with self._lock:
+            if self.ttl_seconds:
+                expired = [p for p, e in self._files.items() if now - e["last_access"] > self.ttl_seconds]
+                for path in expired:
+                    freed += self._delete(path)
+            self.last_sweep = now
+        return freed + self.enforce_quota()
+
+    def cleanup_orphans(self):
+        """Index existing artifacts and remove leftovers from earlier runs
+
+        Removes unfinished ``.part`` downloads, loose files directly under the
+        root (written before per-session directories existed) and files older
+        than the TTL. Remaining files are tracked using their modification time.
+
+        Returns:
+            int: Number of files removed
+        """
+        removed = 0
+        now = self._clock()
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                os.remove(entry.path)
+                removed += 1
+                continue
+            if not entry.is_dir():
+                continue
+            for item in os.scandir(entry.path):
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                if item.name.endswith(PARTIAL_SUFFIX) or \
+                   (self.ttl_seconds and now - stat.st_mtime > self.ttl_seconds):
+                    os.remove(item.path)
+                    removed += 1
+                    continue
+                with self._lock:
+                    if item.path not in self._files:
+                        self._files[item.path] = {"size": stat.st_size, "last_access": stat.st_mtime}
+                        self._bytes += stat.st_size
+            if not os.listdir(entry.path):
+                os.rmdir(entry.path)
+        with self._lock:
+            self.orphans_removed += removed
+        self.enforce_quota()
+        return removed
+
+    def start_sweeper(self):
+        """Start the background sweeper thread (idempotent)"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="artifact-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        """Stop the background sweeper thread"""
+        self._stop.set()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                # A failed sweep must not kill the thread; the next one retries
+                pass
+
+    def stats(self):
+        """Return disk usage and eviction counters for inspection"""
+        with self._lock:
+            sessions = {}
+            for path, entry in self._files.items():
+                session = os.path.basename(os.path.dirname(path))
+                usage = sessions.setdefault(session, {"files": 0, "bytes": 0})
+                usage["files"] += 1
+                usage["bytes"] += entry["size"]
+            return {
+                "root": self.root,
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "quota_bytes": self.quota_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "orphans_removed": self.orphans_removed,
+                "last_sweep": self.last_sweep,
+                "sessions": sessions,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store(root=None, maintain=True):
+    """Return the process-wide artifact store
+
+    On first use the store cleans up orphans from earlier runs and starts its
+    background sweeper, unless ``maintain`` is False.
+
+    Args:
+        root (str, optional): Root directory; defaults to ARTIFACT_ROOT or ./temp
+        maintain (bool, optional): Clean up and sweep the root. Pass False
+            from processes that share the root with a running app (e.g.
+            batch.py), so they don't delete the app's files
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            root = root or os.environ.get("ARTIFACT_ROOT") or os.path.join(os.getcwd(), "temp")
+            _store = ArtifactStore(root)
+            if maintain:
+                _store.cleanup_orphans()
+                _store.start_sweeper()
+        return _store
+
+
+def register_file(path):
+    """Track a newly written file in the process-wide store, if one is in use"""
+    if _store is not None:
+        _store.register(path)
+
+
+def touch_file(path):
+    """Mark a file in the process-wide store as recently used"""
+    if _store is not None:
+        _store.touch(path)
@@ -0,0 +1,284 @@
+"""Headless batch generation.
+
+Runs a JSONL manifest of jobs through Gemini and Replicate on a bounded
+worker pool, without the Streamlit UI. Each manifest line is a JSON object:
+
+    {"id": "cat-1", "type": "chat", "prompt": "Draw a cat", "images": ["cat.png"]}
+    {"id": "cat-1-video", "type": "image_to_video", "prompt": "The cat dances", "image": "cat.png"}
+    {"id": "city", "type": "text_to_video", "prompt": "A futuristic cityscape"}
+
+"type" defaults to "chat". Relative image paths are resolved against the
+manifest's directory, not the current directory. Results are appended to
+<output>/results.jsonl as each job finishes, with generated files written
+next to it. Jobs already recorded as "ok" are skipped, so an interrupted
+run can simply be restarted.
+
+Usage:
+    python batch.py manifest.jsonl --output batch_output --workers 4 --rate 2
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import artifact_store
+import gemini_experimental
+import hedging
+import metrics
+import rate_limit
+import utils
+import video_generation
+from image_store import content_hash
+
+RESULTS_FILE = "results.jsonl"
+
+JOB_TYPES = ("chat", "image_to_video", "text_to_video")
+
+
+def load_manifest(manifest_path):
+    """Read and validate a JSONL manifest
+
+    Relative image paths are made absolute against the manifest's directory.
+
+    Args:
+        manifest_path (str): Path to the manifest
+
+    Returns:
+        list: Job dicts in manifest order
+
+    Raises:
+        ValueError: On malformed lines, missing fields or duplicate ids
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    seen = set()
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{manifest_path}:{line_no}: invalid JSON ({e})")
+            job.setdefault("type", "chat")
+            if "id" not in job or not job.get("prompt"):
+                raise ValueError(f"{manifest_path}:{line_no}: every job needs an 'id' and a 'prompt'")
+            if job["type"] not in JOB_TYPES:
+                raise ValueError(f"{manifest_path}:{line_no}: unknown job type '{job['type']}'")
+            if job["type"] == "image_to_video" and not job.get("image"):
+                raise ValueError(f"{manifest_path}:{line_no}: image_to_video jobs need an 'image'")
+            job["id"] = str(job["id"])
+            # os.path.join keeps absolute paths as they are
+            job["images"] = [os.path.join(base_dir, path) for path in job.get("images", [])]
+            if job.get("image"):
+                job["image"] = os.path.join(base_dir, job["image"])
+            if job["id"] in seen:
+                raise ValueError(f"{manifest_path}:{line_no}: duplicate job id '{job['id']}'")
+            seen.add(job["id"])
+            jobs.append(job)
+    return jobs
+
+
+def completed_job_ids(output_dir):
+    """Return the ids of jobs already recorded as successful in results.jsonl"""
+    done = set()
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash; that job simply runs again
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+def _safe_name(job_id):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in job_id)
+
+
+def _load_image_record(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return {"name": os.path.basename(path), "data": data, "hash": content_hash(data)}
+
+
+def run_chat_job(job, output_dir, gemini_api_key, hedge=None):
+    """Run a chat/image-generation job through gemini_experimental.stream_response
+
+    Returns:
+        dict: Result fields (text, image path, time to first chunk)
+    """
+    images = [_load_image_record(path) for path in job.get("images", [])]
+    messages = [{"role": "user", "content": job["prompt"]}]
+    started = time.monotonic()
+    first_chunk = None
+    hedged = False
+    response_text = ""
+    response_image = None
+    response_mime_type = None
+    for event in gemini_experimental.stream_response(
+        gemini_api_key, job["prompt"], messages=messages, images=images, hedge=hedge
+    ):
+        if first_chunk is None and isinstance(event, (gemini_experimental.TextDelta, gemini_experimental.ImagePart)):
+            first_chunk = time.monotonic() - started
+        if isinstance(event, gemini_experimental.Hedged):
+            hedged = True
+        elif isinstance(event, gemini_experimental.TextDelta):
+            response_text += event.text
+        elif isinstance(event, gemini_experimental.ImagePart):
+            response_image = event.data
+            response_mime_type = event.mime_type
+
+    result = {"text": response_text, "time_to_first_chunk_s": first_chunk, "hedged": hedged}
+    if response_image is not None:
+        extension = response_mime_type.split("/")[1]
+        image_path = os.path.join(output_dir, f"{_safe_name(job['id'])}.{extension}")
+        with open(image_path, "wb") as f:
+            f.write(response_image)
+        result["image"] = image_path
+    return result
+
+
+def run_video_job(job, output_dir):
+    """Run an image-to-video or text-to-video job
+
+    Returns:
+        dict: Result fields (video path)
+    """
+    if job["type"] == "image_to_video":
+        image = _load_image_record(job["image"])
+        model_bytes, model_mime_type = utils.get_model_image(image)
+        video_path = video_generation.generate_video(model_bytes, job["prompt"], output_dir, mime_type=model_mime_type)
+    else:
+        video_path = video_generation.generate_video_from_text(job["prompt"], output_dir)
+
+    final_path = os.path.join(output_dir, f"{_safe_name(job['id'])}.mp4")
+    if os.path.dirname(os.path.abspath(video_path)) == os.path.abspath(output_dir):
+        os.replace(video_path, final_path)
+    else:
+        # Defensive: a video that ended up elsewhere is copied next to the results
+        shutil.copyfile(video_path, final_path)
+    return {"video": final_path}
+
+
+def run_batch(manifest_path, output_dir, workers=4, rate=1.0, gemini_api_key=None, on_result=None, hedge=False):
+    """Run every job of a manifest and stream results to output_dir
+
+    Args:
+        manifest_path (str): Path to the JSONL manifest
+        output_dir (str): Directory for results.jsonl and generated files
+        workers (int, optional): Maximum jobs running at once
+        rate (float, optional): Maximum job starts per second (0 for unlimited)
+        gemini_api_key (str, optional): Defaults to GEMINI_API_KEY
+        on_result (callable, optional): Called with each result dict as it is written
+        hedge (bool, optional): Hedge slow chat requests (see hedging.py)
+
+    Returns:
+        dict: Counts of succeeded, failed and skipped jobs and the total wall time
+    """
+    gemini_api_key = gemini_api_key or os.environ.get("GEMINI_API_KEY")
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = load_manifest(manifest_path)
+    done = completed_job_ids(output_dir)
+    pending = [job for job in jobs if job["id"] not in done]
+    if any(job["type"] != "chat" for job in pending):
+        # The video cache lives in the artifact store, which a running app may
+        # share; create the store first so it skips orphan cleanup and sweeping
+        artifact_store.get_artifact_store(maintain=False)
+    # Spaces job starts; provider calls are additionally held to their own quotas
+    limiter = rate_limit.TokenBucket(rate, capacity=1)
+    hedge_policy = hedging.get_hedge_policy() if hedge else None
+    write_lock = threading.Lock()
+    summary = {"total": len(jobs), "skipped": len(jobs) - len(pending), "ok": 0, "error": 0}
+    started = time.monotonic()
+
+    def run_one(job):
+        waited = limiter.acquire()
+        job_started = time.time()
+        t0 = time.monotonic()
+        result = {"id": job["id"], "type": job["type"], "prompt": job["prompt"]}
+        try:
+            if job["type"] == "chat":
+                if not gemini_api_key:
+                    raise Exception("GEMINI_API_KEY environment variable is not set")
+                result.update(run_chat_job(job, output_dir, gemini_api_key, hedge=hedge_policy))
+            else:
+                result.update(run_video_job(job, output_dir))
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        result["started_at"] = job_started
+        result["rate_limit_wait_s"] = round(waited, 3)
+        result["duration_s"] = round(time.monotonic() - t0, 3)
+        return result
+
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    with open(results_path, "a", encoding="utf-8") as results_file, \
+         ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = [pool.submit(run_one, job) for job in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            with write_lock:
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+                os.fsync(results_file.fileno())
+                summary[result["status"]] += 1
+            if on_result:
+                on_result(result)
+
+    summary["wall_time_s"] = round(time.monotonic() - started, 3)
+    summary["rate_limits"] = rate_limit.limiter_stats()
+    if hedge_policy is not None:
+        summary["hedging"] = hedge_policy.stats()
+    if metrics.ENABLED:
+        with open(os.path.join(output_dir, "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump(metrics.snapshot(), f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run a JSONL manifest of Gemini/Replicate jobs.")
+    parser.add_argument("manifest", help="Path to the JSONL manifest")
+    parser.add_argument("--output", "-o", default="batch_output", help="Output directory (default: batch_output)")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Concurrent jobs (default: 4)")
+    parser.add_argument("--rate", "-r", type=float, default=1.0, help="Max job starts per second, 0 for unlimited (default: 1)")
+    parser.add_argument("--hedge", action="store_true", help="Send a duplicate chat request when the first chunk is slow")
+    args = parser.parse_args(argv)
+
+    def report(result):
+        detail = result.get("error") or result.get("video") or result.get("image") or "text"
+        print(f"[{result['status']}] {result['id']} ({result['duration_s']}s): {detail}", flush=True)
+
+    summary = run_batch(
+        args.manifest, args.output, workers=args.workers, rate=args.rate, on_result=report, hedge=args.hedge
+    )
+    print(
+        f"Done: {summary['ok']} ok, {summary['error']} failed, {summary['skipped']} skipped "
+        f"of {summary['total']} in {summary['wall_time_s']}s"
+    )
+    if "hedging" in summary:
+        hedge_stats = summary["hedging"]
+        print(
+            f"Hedging: {hedge_stats['hedged']} of {hedge_stats['requests']} requests hedged, "
+            f"{hedge_stats['hedge_wins']} won; first-chunk p99 {hedge_stats['observed_latency']['p99']}s "
+            f"observed vs {hedge_stats['attempt_latency']['p99']}s per attempt"
+        )
+    return 1 if summary["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# Defaults for the process-wide store; override via environment variables
+DEFAULT_ROOT = os.environ.get("BLOB_ROOT") or os.path.join(os.getcwd(), "blobs")
+DEFAULT_MEMORY_BYTES = int(os.environ.get("BLOB_MEMORY_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_DISK_BYTES = int(os.environ.get("BLOB_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = int(os.environ.get("BLOB_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+
+
+def content_hash(data):
+    """Return the content hash used to address image bytes
+
+    Args:
+        data (bytes): Binary image data
+
+    Returns:
+        str: Hex BLAKE2b digest of the data
+    """
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def is_blob_ref(value):
+    """Return True if value is a blob reference produced by BlobStore.put"""
+    return isinstance(value, dict) and "hash" in value and "size" in value
+
+
+class BlobStore:
+    """Shared, content-addressed store for image bytes
+
+    Each distinct blob is written once to ``root`` and referenced everywhere
+    else by a small dict: {"hash", "size", "mime_type", "path"}. Reads go
+    through a bounded in-memory LRU tier and fall back to the file on disk,
+    so session state only ever holds references.
+
+    Like the artifact store, the disk is bounded: blobs not read or written
+    for ``ttl_seconds`` are deleted, and past ``disk_bytes`` the least
+    recently used blobs go first. Sizes and access times are indexed by one
+    scan at startup and kept up to date afterwards. Blobs that a live holder
+    (see ``add_holder``) references are never deleted. References to a
+    deleted blob stay valid; reading one raises FileNotFoundError.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, memory_bytes=DEFAULT_MEMORY_BYTES, disk_bytes=DEFAULT_DISK_BYTES,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.root = os.path.abspath(root)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()
+        self._hot_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self.hits = 0
+        self.disk_reads = 0
+        self.evictions = 0
+        self._holders = weakref.WeakSet()
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def add_holder(self, holder):
+        """Pin the blobs ``holder.blob_hashes()`` returns for as long as holder is alive
+
+        Holders are held weakly, so a session's image store stops pinning
+        its blobs once the session is gone.
+        """
+        with self._lock:
+            self._holders.add(holder)
+
+    def _pinned(self):
+        """Return the hashes live holders reference; caller must hold the lock"""
+        pinned = set()
+        for holder in list(self._holders):
+            pinned.update(holder.blob_hashes())
+        return pinned
+
+    def _load_index(self):
+        """Index the blobs on disk, least recently used first"""
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                if item.name.endswith(".tmp"):
+                    continue
+                stat = item.stat()
+                found.append((stat.st_mtime, item.name, stat.st_size))
+        for mtime, blob_hash, size in sorted(found):
+            self._disk[blob_hash] = {"size": size, "last_access": mtime}
+            self._disk_used += size
+
+    def _used(self, blob_hash, size):
+        """Record a blob as most recently used; caller must hold the lock"""
+        entry = self._disk.pop(blob_hash, None)
+        if entry is not None:
+            self._disk_used -= entry["size"]
+        self._disk[blob_hash] = {"size": size, "last_access": self._clock()}
+        self._disk_used += size
+
+    def path(self, blob_hash):
+        """Return the on-disk path of a blob"""
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    def exists(self, blob_hash):
+        """Return True if the blob is stored"""
+        return os.path.isfile(self.path(blob_hash))
+
+    def put(self, data, mime_type=None):
+        """Store bytes once and return a reference to them
+
+        Args:
+            data (bytes): Blob contents
+            mime_type (str, optional): MIME type recorded on the reference
+
+        Returns:
+            dict: Reference with "hash", "size", "mime_type" and "path"
+        """
+        blob_hash = content_hash(data)
+        path = self.path(blob_hash)
+        if os.path.isfile(path):
+            # Refresh the on-disk access time, which orders eviction after a restart
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see partial blobs
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._used(blob_hash, len(data))
+        self._remember(blob_hash, bytes(data))
+        self.enforce_quota(keep=blob_hash)
+        return self.ref(blob_hash, len(data), mime_type)
+
+    def ref(self, blob_hash, size, mime_type=None):
+        """Return the reference for a stored blob, as put returns it"""
+        return {"hash": blob_hash, "size": size, "mime_type": mime_type, "path": self.path(blob_hash)}
+
+    def _remember(self, blob_hash, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if blob_hash in self._hot:
+                self._hot.move_to_end(blob_hash)
+                return
+            self._hot[blob_hash] = data
+            self._hot_bytes += len(data)
+            while self._hot_bytes > self.memory_bytes:
+                _, old = self._hot.popitem(last=False)
+                self._hot_bytes -= len(old)
+
+    def read(self, ref):
+        """Return the bytes of a blob
+
+        Args:
+            ref (dict or str): Blob reference or hash
+
+        Returns:
+            bytes: Blob contents
+        """
+        blob_hash = ref["hash"] if isinstance(ref, dict) else ref
+        with self._lock:
+            data = self._hot.get(blob_hash)
+            if data is not None:
+                self._hot.move_to_end(blob_hash)
+                self._used(blob_hash, len(data))
+                self.hits += 1
+                return data
+            self.disk_reads += 1
+        path = self.path(blob_hash)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        with self._lock:
+            self._used(blob_hash, len(data))
+        self._remember(blob_hash, data)
+        return data
+
+    def enforce_quota(self, keep=None):
+        """Delete expired blobs, then least recently used ones until under disk_bytes
+
+        Args:
+            keep (str, optional): Hash that must not be deleted (e.g. the blob just written)
+
+        Returns:
+            int: Blobs deleted
+        """
+        now = self._clock()
+        evicted = []
+        kept = []
+        with self._lock:
+            pinned = None
+            used = self._disk_used
+            for blob_hash, entry in self._disk.items():
+                expired = now - entry["last_access"] > self.ttl_seconds
+                if not expired and used <= self.disk_bytes:
+                    break
+                if pinned is None:
+                    pinned = self._pinned()
+                if blob_hash == keep or blob_hash in pinned:
+                    kept.append(blob_hash)
+                    continue
+                used -= entry["size"]
+                evicted.append(blob_hash)
+            # Pinned blobs count as used now, so later passes don't walk past them again
+            for blob_hash in kept:
+                self._disk[blob_hash]["last_access"] = now
+                self._disk.move_to_end(blob_hash)
+            for blob_hash in evicted:
+                self._disk_used -= self._disk.pop(blob_hash)["size"]
+                hot = self._hot.pop(blob_hash, None)
+                if hot is not None:
+                    self._hot_bytes -= len(hot)
+                self.evictions += 1
+        for blob_hash in evicted:
+            try:
+                os.remove(self.path(blob_hash))
+            except FileNotFoundError:
+                pass
+        return len(evicted)
+
+    def open_mmap(self, ref):
+        """Memory-map a blob read-only, without copying it into the heap
+
+        The caller must close the returned mmap.
+
+        Args:
+            ref (dict or str): Blob reference or hash
+
+        Returns:
+            mmap.mmap: Read-only mapping of the blob
+        """
+        blob_hash = ref["hash"] if isinstance(ref, dict) else ref
+        with open(self.path(blob_hash), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def stats(self):
+        """Return memory-tier usage and read counters"""
+        with self._lock:
+            return {
+                "root": self.root,
+                "memory_entries": len(self._hot),
+                "memory_bytes": self._hot_bytes,
+                "memory_limit": self.memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+                "disk_limit": self.disk_bytes,
+                "hits": self.hits,
+                "disk_reads": self.disk_reads,
+                "evictions": self.evictions,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """Return the process-wide blob store shared by every session"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+        return _store
+
+
+def put(data, mime_type=None):
+    """Store bytes in the process-wide blob store and return a reference"""
+    return get_blob_store().put(data, mime_type)
+
+
+def read(ref):
+    """Read bytes for a reference from the process-wide blob store"""
+    return get_blob_store().read(ref)
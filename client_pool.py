@@ -0,0 +1,219 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the process-wide registry. Streamlit imports modules once per
+# process, so the registry below is shared by every browser session.
+DEFAULT_MAX_CLIENTS = 16
+DEFAULT_IDLE_TIMEOUT = 15 * 60  # seconds
+
+# Connection pool settings for the httpx client that backs replicate.Client
+REPLICATE_POOL_LIMITS = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60,
+}
+
+
+def _fingerprint(value):
+    """Return a short, non-reversible fingerprint for a secret such as an API key"""
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:10]
+
+
+def _freeze(value):
+    """Turn a (possibly nested) dict/list config into a hashable tuple"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ClientRegistry:
+    """Bounded, thread-safe registry of long-lived API clients
+
+    Clients are keyed by (kind, api key, config). Reusing a client keeps its
+    HTTP connection pool alive, so repeated calls skip TLS handshakes and
+    client construction. The registry evicts the least recently used client
+    when full and drops clients that have been idle longer than
+    ``idle_timeout`` seconds.
+
+    Evicted clients are not closed: another session may still be using one
+    (e.g. midway through a stream). The registry only drops its reference,
+    and the client's connections are closed when it is garbage collected.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_CLIENTS, idle_timeout=DEFAULT_IDLE_TIMEOUT, clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, kind, api_key, factory, config=None):
+        """Return a cached client, building it with ``factory`` on a miss
+
+        Args:
+            kind (str): Client family, e.g. "gemini" or "replicate"
+            api_key (str): API key the client is authenticated with
+            factory (callable): Zero-argument callable that builds the client
+            config (dict, optional): Client configuration that is part of the key
+
+        Returns:
+            object: The pooled client
+        """
+        key = (kind, api_key, _freeze(config or {}))
+        now = self._clock()
+        with self._lock:
+            self._pop_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry["last_used"] = now
+                entry["uses"] += 1
+                self._hits += 1
+                return entry["client"]
+            self._misses += 1
+
+        # Built without the lock, so a slow construction doesn't hold up other lookups
+        client = factory()
+
+        with self._lock:
+            entry = self._entries.setdefault(key, {
+                "client": client,
+                "created": now,
+                "last_used": now,
+                "uses": 0,
+            })
+            # Another thread may have built one meanwhile; keep that one
+            self._entries.move_to_end(key)
+            entry["last_used"] = self._clock()
+            entry["uses"] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return entry["client"]
+
+    def _pop_idle(self, now):
+        """Remove idle entries; caller must hold the lock. Returns removed clients"""
+        removed = []
+        if self.idle_timeout is None:
+            return removed
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if now - entry["last_used"] > self.idle_timeout:
+                removed.append(self._entries.pop(key)["client"])
+                self._evictions += 1
+        return removed
+
+    def evict_idle(self):
+        """Drop every client that has exceeded the idle timeout
+
+        Returns:
+            int: Number of clients evicted
+        """
+        with self._lock:
+            return len(self._pop_idle(self._clock()))
+
+    def clear(self):
+        """Forget every pooled client"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a snapshot of the registry for inspection
+
+        API keys are never included; each entry carries a short fingerprint instead.
+
+        Returns:
+            dict: Size, limits, hit/miss/eviction counters and per-client details
+        """
+        now = self._clock()
+        with self._lock:
+            entries = [
+                {
+                    "kind": kind,
+                    "key_fingerprint": _fingerprint(api_key),
+                    "config": dict(config),
+                    "age_seconds": round(now - entry["created"], 3),
+                    "idle_seconds": round(now - entry["last_used"], 3),
+                    "uses": entry["uses"],
+                }
+                for (kind, api_key, config), entry in self._entries.items()
+            ]
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_timeout": self.idle_timeout,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "clients": entries,
+            }
+
+
+# Process-wide registry shared across Streamlit sessions
+_registry = ClientRegistry()
+
+
+def get_registry():
+    """Return the process-wide client registry"""
+    return _registry
+
+
+def get_gemini_client(api_key, http_options=None):
+    """Return a pooled Gemini client for the given API key
+
+    The genai client owns a persistent httpx client, so reusing it keeps
+    connections alive between chat turns.
+
+    Args:
+        api_key (str): The API key for Gemini
+        http_options (dict, optional): Extra ``types.HttpOptions`` fields (e.g. timeout)
+
+    Returns:
+        genai.Client: The pooled client
+    """
+    def factory():
+        from google import genai
+        from google.genai import types
+
+        if http_options:
+            return genai.Client(api_key=api_key, http_options=types.HttpOptions(**http_options))
+        return genai.Client(api_key=api_key)
+
+    return _registry.get("gemini", api_key, factory, config=http_options)
+
+
+def get_replicate_client(api_token, timeout=None):
+    """Return a pooled Replicate client for the given API token
+
+    Args:
+        api_token (str): The Replicate API token
+        timeout (float, optional): Request timeout in seconds
+
+    Returns:
+        replicate.Client: The pooled client
+    """
+    def factory():
+        import httpx
+        import replicate
+
+        # replicate.Client wraps the given transport in its RetryTransport;
+        # httpx ignores limits= once a transport is supplied, so the pool
+        # limits have to be set on the transport itself
+        kwargs = {"transport": httpx.HTTPTransport(limits=httpx.Limits(**REPLICATE_POOL_LIMITS))}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return replicate.Client(api_token=api_token, **kwargs)
+
+    return _registry.get("replicate", api_token, factory, config={"timeout": timeout})
+
+
+def registry_stats():
+    """Return inspection data for the process-wide client registry"""
+    return _registry.stats()
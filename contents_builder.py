@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+
+from google.genai import types
+
+import blob_store
+import history_planner
+import metrics
+import utils
+
+# Which user turns carry the uploaded images
+ATTACH_FIRST_TURN = "first_turn"    # the first user turn in the request that has images
+ATTACH_EVERY_TURN = "every_turn"    # every user turn, with the images it was sent with
+ATTACH_LATEST_TURN = "latest_turn"  # only the turn being sent now
+ATTACH_NONE = "none"                # never
+ATTACH_POLICIES = (ATTACH_FIRST_TURN, ATTACH_EVERY_TURN, ATTACH_LATEST_TURN, ATTACH_NONE)
+
+DEFAULT_ATTACH_POLICY = os.environ.get("GEMINI_IMAGE_ATTACH", ATTACH_FIRST_TURN)
+
+
+def inline_image_part(data, mime_type, image_hash=None):
+    """Return a part carrying the image bytes inline"""
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+def content_bytes(content):
+    """Return the bytes of text and inline data carried by one Content"""
+    total = 0
+    for part in content.parts:
+        if part.inline_data is not None:
+            total += len(part.inline_data.data)
+        elif part.text:
+            total += len(part.text.encode("utf-8"))
+    return total
+
+
+class ContentsBuilder:
+    """Builds request contents for one conversation, reusing past turns
+
+    Each message's ``types.Content`` is built once and cached by message id
+    (and the images attached to it), so a new turn only builds its own
+    content instead of re-reading blobs and re-wrapping every image in the
+    history. Image parts are shared by content hash across turns. Entries
+    not used by the latest request are dropped.
+
+    Messages without an id (history placeholders and summaries) are cheap
+    text and are built on every request. Builds are serialized, so parallel
+    requests for the same turn (e.g. image variants) build it once.
+
+    The turn being sent is the last message when it is the user's prompt;
+    otherwise the prompt is appended as a new user turn. Uploaded images are
+    attached according to ``attach_policy`` (see ATTACH_POLICIES): the turn
+    being sent carries the ``images`` passed in, earlier turns the images
+    recorded on them (their "images" hash list), when still uploaded.
+    """
+
+    def __init__(self, image_part=inline_image_part, attach_policy=DEFAULT_ATTACH_POLICY):
+        if attach_policy not in ATTACH_POLICIES:
+            raise ValueError(f"Unknown image attach policy: {attach_policy}")
+        self.image_part = image_part
+        self.attach_policy = attach_policy
+        self._lock = threading.Lock()
+        self._contents = {}
+        self._image_parts = {}
+        self.last_report = None
+        self.builds = 0
+        self.reused = 0
+        self.built = 0
+
+    def turns(self, prompt, messages=None, images=None):
+        """Return the request turns with the images each one carries
+
+        Returns:
+            list: (message, image_records) tuples, oldest first
+        """
+        messages = list(messages or [])
+        if not messages or messages[-1]["role"] != "user" or messages[-1]["content"] != prompt:
+            messages.append({"role": "user", "content": prompt})
+        records = {img["hash"]: img for img in images or []}
+        latest = len(messages) - 1
+
+        turns = []
+        attached_once = False
+        for idx, message in enumerate(messages):
+            attached = []
+            if message["role"] == "user" and self.attach_policy != ATTACH_NONE:
+                if idx == latest:
+                    candidates = list(images or [])
+                elif self.attach_policy != ATTACH_LATEST_TURN:
+                    candidates = [records[h] for h in message.get("images") or [] if h in records]
+                else:
+                    candidates = []
+                if candidates and not (self.attach_policy == ATTACH_FIRST_TURN and attached_once):
+                    attached = candidates
+                    attached_once = True
+            turns.append((message, attached))
+        return turns
+
+    def attached_hashes(self, prompt, messages=None, images=None):
+        """Return the content hashes of every image the request will carry, in order"""
+        return [img["hash"] for _, attached in self.turns(prompt, messages, images) for img in attached]
+
+    def _image(self, img_data):
+        image_hash = img_data["hash"]
+        part = self._image_parts.get(image_hash)
+        if part is None:
+            # Send the downscaled variant with its real MIME type
+            model_bytes, model_mime_type = utils.get_model_image(img_data)
+            # Key on the sent variant's blob hash, not the original upload
+            variant_hash = img_data["model_blob"]["hash"]
+            part = self._image_parts[image_hash] = self.image_part(model_bytes, model_mime_type, variant_hash)
+        return part
+
+    def _build_content(self, message, attached):
+        if message["role"] == "user":
+            parts = []
+            for img in attached:
+                try:
+                    parts.append(self._image(img))
+                except FileNotFoundError:
+                    # Evicted since the chat tab checked; the turn goes without it
+                    continue
+            parts.append(types.Part.from_text(text=message["content"]))
+            return types.Content(role="user", parts=parts)
+        if isinstance(message["content"], str):
+            return types.Content(role="model", parts=[types.Part.from_text(text=message["content"])])
+        # Generated image: read from the blob store only the first time
+        try:
+            data = blob_store.read(message["content"])
+        except FileNotFoundError:
+            # Evicted from the blob store; send the same text the history planner uses
+            return types.Content(role="model", parts=[types.Part.from_text(text=history_planner.IMAGE_PLACEHOLDER)])
+        return types.Content(role="model", parts=[self.image_part(data, message["mime_type"], message["content"]["hash"])])
+
+    def build(self, prompt, messages=None, images=None):
+        """Build the request contents for a chat turn
+
+        Args:
+            prompt (str): The text prompt being sent
+            messages (list, optional): Chat history, oldest first; may end with the prompt
+            images (list, optional): Uploaded image records
+
+        Returns:
+            list: types.Content objects, oldest first
+        """
+        with self._lock:
+            return self._build(prompt, messages, images)
+
+    def _build(self, prompt, messages, images):
+        started = time.perf_counter()
+        contents = []
+        used = {}
+        used_images = {}
+        total_bytes = 0
+        reused = built = 0
+        for message, attached in self.turns(prompt, messages, images):
+            key = (message["id"], tuple(img["hash"] for img in attached)) if message.get("id") else None
+            entry = self._contents.get(key) if key else None
+            if entry is None:
+                content = self._build_content(message, attached)
+                entry = (content, content_bytes(content))
+                built += 1
+            else:
+                reused += 1
+            if key:
+                used[key] = entry
+            for img in attached:
+                if img["hash"] in self._image_parts:
+                    used_images[img["hash"]] = self._image_parts[img["hash"]]
+            contents.append(entry[0])
+            total_bytes += entry[1]
+
+        # Keep only what the latest request used, so memory follows the planned history
+        self._contents = used
+        self._image_parts = used_images
+        seconds = time.perf_counter() - started
+        self.builds += 1
+        self.reused += reused
+        self.built += built
+        self.last_report = {
+            "seconds": seconds,
+            "bytes": total_bytes,
+            "contents": len(contents),
+            "reused": reused,
+            "built": built,
+        }
+        metrics.observe("contents_build_seconds", seconds)
+        metrics.inc("gemini_request_bytes_total", total_bytes)
+        metrics.inc("contents_reused_total", reused)
+        metrics.inc("contents_built_total", built)
+        return contents
+
+    def invalidate(self):
+        """Drop every cached content, e.g. after uploaded file handles expired"""
+        with self._lock:
+            self._contents = {}
+            self._image_parts = {}
+
+    def stats(self):
+        """Return build counters, cache size and the last build's report"""
+        return {
+            "builds": self.builds,
+            "reused": self.reused,
+            "built": self.built,
+            "cached_contents": len(self._contents),
+            "cached_images": len(self._image_parts),
+            "last": self.last_report,
+        }
@@ -0,0 +1,155 @@
+"""Benchmark full-app reruns against fragment reruns.
+
+Removing an image, a text chat turn and typing in a video form rerun only
+their own fragment; other interactions (new uploads, generated images,
+Clear Chat) still rerun app.py in full. This script seeds a session with a
+chat history and an image gallery and times, with Streamlit's AppTest:
+
+    full app        a full rerun of the current app.py
+    gallery         removing an image (sidebar fragment)
+    chat            a text-only chat turn (chat tab fragment)
+    image_to_video  typing or selecting in the image-to-video form
+
+Every case runs the current tree, so the ratios compare a full rerun with
+a fragment rerun of the same code. They are not a measurement of the code
+before fragments were introduced, whose full reruns also lacked later
+changes such as per-message render caching.
+
+No API calls are made; GEMINI_API_KEY only needs to be set to something.
+
+Usage (from the repository root):
+    python experiment/bench_reruns.py --turns 200 --images 12 --runs 5
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+import artifact_store
+import blob_store
+import image_store
+import video_generation
+
+SESSION_ID = "benchmark"
+
+
+def make_image(seed, size):
+    image = Image.new("RGB", (size, size), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def seed_session(turns, images):
+    """Build session state with `images` uploads and `turns` chat turns (every 10th answer is an image)"""
+    store = image_store.ImageStore()
+    hashes = []
+    for i in range(images):
+        record, _ = store.add(make_image(i, 1600), f"photo_{i}.jpg", kind=image_store.UPLOADED, mime_type="image/jpeg")
+        hashes.append(record["hash"])
+
+    messages = []
+    for turn in range(turns):
+        messages.append({
+            "role": "user",
+            "content": f"Question {turn}: describe the picture in more detail.",
+            "images": hashes if turn == 0 else None,
+        })
+        if turn % 10 == 9:
+            image_ref = blob_store.put(make_image(1000 + turn, 768), "image/jpeg")
+            messages.append({
+                "role": "assistant",
+                "content": image_ref,
+                "mime_type": "image/jpeg",
+            })
+        else:
+            messages.append({"role": "assistant", "content": f"Answer {turn}. " + "Lorem ipsum dolor sit amet. " * 20})
+
+    return {
+        "session_id": SESSION_ID,
+        "temp_dir": artifact_store.get_artifact_store().session_dir(SESSION_ID),
+        "messages": messages,
+        "image_store": store,
+        "video_generation_state": video_generation.reset_video_state(),
+        "text_video_prompt": "",
+        "text_video_error": None,
+    }
+
+
+def gallery_script():
+    import streamlit as st
+    import ui_components
+    ui_components._render_image_gallery(st.session_state)
+
+
+def chat_script():
+    import streamlit as st
+    import ui_components
+    import utils
+    ui_components.render_chat_tab(
+        st.session_state,
+        "benchmark",
+        lambda data, mime_type: utils.save_binary_file(data, mime_type, st.session_state.temp_dir),
+        None,
+    )
+
+
+def image_to_video_script():
+    import streamlit as st
+    import ui_components
+    import video_generation
+    import video_jobs
+    ui_components._render_image_to_video_section(
+        st.session_state, video_generation, st.session_state.temp_dir, video_jobs.get_job_manager()
+    )
+
+
+def time_runs(app, state, runs):
+    """Return the median seconds of `runs` reruns, after one warm-up run"""
+    for key, value in state.items():
+        app.session_state[key] = value
+    app.run(timeout=120)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        app.run(timeout=120)
+        samples.append(time.perf_counter() - started)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time full-app reruns against fragment reruns.")
+    parser.add_argument("--turns", type=int, default=200, help="Chat turns in the seeded history (default: 200)")
+    parser.add_argument("--images", type=int, default=12, help="Uploaded images in the gallery (default: 12)")
+    parser.add_argument("--runs", type=int, default=5, help="Timed reruns per section (default: 5)")
+    args = parser.parse_args()
+
+    cases = [
+        ("full app", lambda: AppTest.from_file(os.path.join(ROOT, "app.py"))),
+        ("gallery", lambda: AppTest.from_function(gallery_script)),
+        ("chat", lambda: AppTest.from_function(chat_script)),
+        ("image_to_video", lambda: AppTest.from_function(image_to_video_script)),
+    ]
+
+    print(f"{args.turns} chat turns, {args.images} images, median of {args.runs} reruns")
+    print(f"{'case':<16} {'median':>12}  {'vs full app':>11}")
+    full_app = None
+    for name, make_app in cases:
+        seconds = time_runs(make_app(), seed_session(args.turns, args.images), args.runs)
+        full_app = full_app or seconds
+        print(f"{name:<16} {seconds * 1000:9.1f} ms  {full_app / seconds:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
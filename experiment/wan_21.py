@@ -1,4 +1,3 @@
-import base64
 import os
 
 from dotenv import load_dotenv
@@ -22,19 +21,20 @@ def generate_video_from_local_image(image_path, prompt, output_path="output.mp4"
     Returns:
         str: Path to the generated video file
     """
-    # Read the image file and encode it as base64
+    # Run the model with authenticated client
+    client = replicate.Client(api_token=replicate_api_key)
+    
+    # Upload the image once through the Replicate Files API and pass its URL,
+    # rather than inlining a base64 data URI with a hardcoded MIME type
     with open(image_path, "rb") as image_file:
-        # Convert the image to base64 for API consumption
-        image_data = base64.b64encode(image_file.read()).decode("utf-8")
+        uploaded = client.files.create(image_file)
         
     # Prepare the input for the model
     input = {
-        "image": f"data:image/jpeg;base64,{image_data}",
+        "image": uploaded.urls["get"],
         "prompt": prompt
     }
     
-    # Run the model with authenticated client
-    client = replicate.Client(api_token=replicate_api_key)
     output = client.run(
         "wavespeedai/wan-2.1-i2v-480p",
         input=input
@@ -0,0 +1,224 @@
+import io
+import itertools
+import threading
+import time
+
+from google.genai import types
+
+import client_pool
+from image_store import content_hash
+
+# Re-upload a file this many seconds before the service says it expires
+DEFAULT_REFRESH_MARGIN = 5 * 60
+
+# Gemini Files API keeps uploads for 48 hours
+GEMINI_FILE_TTL = 48 * 60 * 60
+
+# Assumed lifetime of Replicate uploads when the API doesn't report one
+REPLICATE_FILE_TTL = 24 * 60 * 60
+
+
+class GeminiFilesBackend:
+    """Uploads files through the Gemini Files API"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, data, mime_type, display_name=None):
+        """Upload bytes and return a handle dict
+
+        Returns:
+            dict: {"uri", "mime_type", "name", "expires_at"} with expires_at as a Unix timestamp
+        """
+        config = types.UploadFileConfig(mime_type=mime_type, display_name=display_name)
+        uploaded = self.client.files.upload(file=io.BytesIO(data), config=config)
+        expires_at = uploaded.expiration_time.timestamp() if uploaded.expiration_time else time.time() + GEMINI_FILE_TTL
+        return {
+            "uri": uploaded.uri,
+            "mime_type": uploaded.mime_type or mime_type,
+            "name": uploaded.name,
+            "expires_at": expires_at,
+        }
+
+
+class ReplicateFilesBackend:
+    """Uploads files through the Replicate Files API
+
+    The returned handle's "uri" is an HTTPS URL that can be passed as a model
+    input in place of a base64 data URI.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, data, mime_type, display_name=None):
+        """Upload bytes and return a handle dict
+
+        Returns:
+            dict: {"uri", "mime_type", "name", "expires_at"} with expires_at as a Unix timestamp
+        """
+        # The client derives the upload's content type from the file name
+        extension = mime_type.split("/")[-1] if mime_type else "bin"
+        file = io.BytesIO(data)
+        file.name = f"{display_name or 'upload'}.{extension}"
+        uploaded = self.client.files.create(file)
+        expires_at = getattr(uploaded, "expires_at", None)
+        if expires_at is None:
+            expires_at = time.time() + REPLICATE_FILE_TTL
+        elif hasattr(expires_at, "timestamp"):
+            expires_at = expires_at.timestamp()
+        return {
+            "uri": uploaded.urls["get"],
+            "mime_type": getattr(uploaded, "content_type", None) or mime_type,
+            "name": uploaded.id,
+            "expires_at": expires_at,
+        }
+
+
+class LocalFileService:
+    """In-memory stand-in for the Files API, for tests and local development"""
+
+    def __init__(self, ttl=GEMINI_FILE_TTL, clock=time.time):
+        self.ttl = ttl
+        self._clock = clock
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.files = {}
+        self.upload_count = 0
+
+    def upload(self, data, mime_type, display_name=None):
+        with self._lock:
+            name = f"files/local-{next(self._counter)}"
+            self.upload_count += 1
+        handle = {
+            "uri": f"local://{name}",
+            "mime_type": mime_type,
+            "name": name,
+            "expires_at": self._clock() + self.ttl,
+        }
+        self.files[handle["uri"]] = {"data": data, "handle": handle}
+        return handle
+
+    def delete(self, uri):
+        """Forget an uploaded file, as if the service had dropped it"""
+        self.files.pop(uri, None)
+
+
+class FileHandleCache:
+    """Caches uploaded-file handles by content hash
+
+    Works with any backend exposing ``upload(data, mime_type, display_name)``
+    (Gemini Files API, Replicate Files API or the local fake).
+
+    Each image is uploaded once; later requests reference it by URI.
+    Handles that are expired (or about to expire) are re-uploaded
+    transparently, and ``invalidate`` forces a re-upload for handles the
+    service no longer knows about.
+    """
+
+    def __init__(self, backend, refresh_margin=DEFAULT_REFRESH_MARGIN, clock=time.time):
+        self.backend = backend
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._uploading = {}
+        self.hits = 0
+        self.uploads = 0
+        self.bytes_uploaded = 0
+
+    def get_handle(self, data, mime_type, image_hash=None):
+        """Return a live handle for the bytes, uploading them if needed
+
+        Args:
+            data (bytes): Image bytes
+            mime_type (str): MIME type of the bytes
+            image_hash (str, optional): Precomputed content hash of data
+
+        Returns:
+            dict: Handle with "uri", "mime_type" and "expires_at"
+        """
+        image_hash = image_hash or content_hash(data)
+        while True:
+            with self._lock:
+                handle = self._handles.get(image_hash)
+                if handle and handle["expires_at"] - self.refresh_margin > self._clock():
+                    self.hits += 1
+                    return handle
+                pending = self._uploading.get(image_hash)
+                if pending is None:
+                    # This thread uploads; concurrent callers wait for it
+                    pending = threading.Event()
+                    self._uploading[image_hash] = pending
+                    break
+            pending.wait()
+
+        try:
+            handle = self.backend.upload(data, mime_type, display_name=image_hash[:16])
+            with self._lock:
+                self._handles[image_hash] = handle
+                self.uploads += 1
+                self.bytes_uploaded += len(data)
+            return handle
+        finally:
+            with self._lock:
+                self._uploading.pop(image_hash, None)
+            pending.set()
+
+    def part_for(self, data, mime_type, image_hash=None):
+        """Return a ``types.Part`` referencing the uploaded file by URI"""
+        handle = self.get_handle(data, mime_type, image_hash=image_hash)
+        return types.Part.from_uri(file_uri=handle["uri"], mime_type=handle["mime_type"])
+
+    def invalidate(self, image_hashes=None):
+        """Drop cached handles so the next request re-uploads them
+
+        Args:
+            image_hashes (iterable, optional): Hashes to drop; all handles if None
+        """
+        with self._lock:
+            if image_hashes is None:
+                self._handles.clear()
+            else:
+                for image_hash in image_hashes:
+                    self._handles.pop(image_hash, None)
+
+    def stats(self):
+        """Return cache size and upload counters"""
+        with self._lock:
+            return {
+                "handles": len(self._handles),
+                "hits": self.hits,
+                "uploads": self.uploads,
+                "bytes_uploaded": self.bytes_uploaded,
+            }
+
+
+# One cache per API key, shared by every session in the process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_file_cache(gemini_api_key):
+    """Return the process-wide Files API handle cache for an API key"""
+    with _caches_lock:
+        cache = _caches.get(gemini_api_key)
+        if cache is None:
+            backend = GeminiFilesBackend(client_pool.get_gemini_client(gemini_api_key))
+            cache = FileHandleCache(backend)
+            _caches[gemini_api_key] = cache
+        return cache
+
+
+_replicate_caches = {}
+
+
+def get_replicate_file_cache(replicate_api_key):
+    """Return the process-wide Replicate upload handle cache for an API token"""
+    with _caches_lock:
+        cache = _replicate_caches.get(replicate_api_key)
+        if cache is None:
+            backend = ReplicateFilesBackend(client_pool.get_replicate_client(replicate_api_key))
+            cache = FileHandleCache(backend)
+            _replicate_caches[replicate_api_key] = cache
+        return cache
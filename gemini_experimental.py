@@ -1,114 +1,301 @@
-import os
-import pathlib
-from google import genai
+import itertools
+import time
+from collections import namedtuple
+from google.genai import errors
 from google.genai import types
+import client_pool
+import history_planner
+import response_cache
+import rate_limit
+import hedging
+import metrics
+import contents_builder
+from contents_builder import inline_image_part
 
-def generate_response(gemini_api_key, prompt, messages=None, images=None):
-    """Generate a response from Gemini model
+MODEL = "gemini-2.0-flash-preview-image-generation"
+
+# Typed events yielded by stream_response
+TextDelta = namedtuple("TextDelta", ["text"])
+ImagePart = namedtuple("ImagePart", ["data", "mime_type"])
+FinishReason = namedtuple("FinishReason", ["reason"])
+Usage = namedtuple("Usage", ["prompt_tokens", "response_tokens", "total_tokens"])
+HistoryPlan = namedtuple("HistoryPlan", ["report"])
+CacheHit = namedtuple("CacheHit", ["key"])
+Hedged = namedtuple("Hedged", ["model"])
+
+# Generation settings for chat turns; also part of the response cache key
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_modalities": [
+        "text",
+        "image",
+    ],
+    "response_mime_type": "text/plain",
+}
+
+
+def build_contents(prompt, messages=None, images=None, image_part=inline_image_part):
+    """Build the request contents for a chat turn without reusing earlier builds
+    
+    Args:
+        prompt (str): The text prompt to send to Gemini
+        messages (list, optional): Previous chat history; may end with the prompt
+        images (list, optional): List of image data dictionaries
+        image_part (callable, optional): Builds the part for an image from
+            (data, mime_type, image_hash); defaults to inline bytes
+        
+    Returns:
+        list: List of types.Content objects, oldest first
+    """
+    return contents_builder.ContentsBuilder(image_part=image_part).build(prompt, messages, images)
+
+
+def payload_bytes(contents):
+    """Return the bytes of text and inline data carried by request contents"""
+    return sum(contents_builder.content_bytes(content) for content in contents)
+
+
+def build_generation_config():
+    """Return the generation config used for chat turns"""
+    return types.GenerateContentConfig(**GENERATION_CONFIG)
+
+
+class _ChunkStream:
+    """Response chunks whose first chunk has already arrived"""
+    
+    def __init__(self, first_chunk, stream):
+        self._stream = stream
+        self._chunks = itertools.chain([first_chunk], stream) if first_chunk is not None else iter(())
+    
+    def __iter__(self):
+        return self._chunks
+    
+    def close(self):
+        """Abandon the stream and release its connection"""
+        close = getattr(self._stream, "close", None)
+        if callable(close):
+            close()
+
+
+def _open_stream(client, contents, model=MODEL):
+    """Start a streaming request and wait for its first chunk
+    
+    Request errors surface here rather than midway through consuming the stream.
+    
+    Returns:
+        _ChunkStream: The response chunks, including the first one
+    """
+    stream = iter(client.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=build_generation_config(),
+    ))
+    return _ChunkStream(next(stream, None), stream)
+
+
+def stream_response(gemini_api_key, prompt, messages=None, images=None, history_budget=None, file_cache=None,
+                    cache=None, bypass_cache=False, hedge=None, builder=None):
+    """Stream a response from Gemini model as typed events
+    
+    Events are yielded as soon as each chunk arrives, so callers can render
+    the first token without waiting for the rest of the answer.
     
     Args:
         gemini_api_key (str): The API key for Gemini
         prompt (str): The text prompt to send to Gemini
         messages (list, optional): Previous chat history
         images (list, optional): List of image data dictionaries
-        helicone_api_key (str, optional): API key for Helicone monitoring
+        history_budget (dict, optional): Keyword arguments for
+            history_planner.plan_history. When given, the history is fitted
+            into that budget and a HistoryPlan event is yielded first.
+        file_cache (file_uploads.FileHandleCache, optional): When given,
+            images are uploaded once through the Files API and referenced by
+            URI instead of being sent inline on every request.
+        cache (response_cache.ResponseCache, optional): Serve identical
+            requests from this cache and store completed responses in it
+        bypass_cache (bool, optional): Skip the cache lookup (e.g. for a
+            fresh sample); the new response still replaces the cached one
+        hedge (hedging.HedgePolicy, optional): When given, a duplicate
+            request is sent if the first chunk is slower than usual and the
+            first stream to answer is used. A Hedged event is yielded when
+            the duplicate won.
+        builder (contents_builder.ContentsBuilder, optional): The
+            conversation's builder, which reuses contents built for earlier
+            turns and decides which turns carry the images. Its image_part
+            takes the place of the one chosen from file_cache. A fresh
+            builder is used when omitted.
         
-    Returns:
-        tuple: (response_text, response_image, response_mime_type)
+    Yields:
+        HistoryPlan | CacheHit | Hedged | TextDelta | ImagePart | FinishReason | Usage:
+        Response events. A FinishReason and a Usage event (when reported)
+        close the stream.
     """
-    client = genai.Client(api_key=gemini_api_key)
-    model = "gemini-2.0-flash-preview-image-generation"
-    
-    # Prepare content parts
-    parts = []
-    
-    # Add images to every message if we have images
-    if images and len(messages) == 1:
-        for img_data in images:
-            parts.append(
-                types.Part.from_bytes(
-                    data=img_data["data"],
-                    mime_type="image/jpeg"
-                )
-            )
-    
-    # Add text prompt
-    parts.append(types.Part.from_text(text=prompt))
-    
-    # Create content
-    contents = [
-        types.Content(
-            role="user",
-            parts=parts,
+    client = client_pool.get_gemini_client(gemini_api_key)
+    if builder is None:
+        builder = contents_builder.ContentsBuilder(
+            image_part=file_cache.part_for if file_cache is not None else inline_image_part
+        )
+    
+    if history_budget is not None and messages:
+        # Count the uploaded images each turn will carry, as the builder attaches them
+        messages, report = history_planner.plan_history(
+            messages, attach=lambda planned: builder.turns(prompt, planned, images), **history_budget
+        )
+        yield HistoryPlan(report)
+    
+    cache_key = None
+    if cache is not None:
+        cache_key = response_cache.make_key(
+            MODEL, GENERATION_CONFIG, prompt, messages,
+            builder.attached_hashes(prompt, messages, images)
+        )
+        cached = None if bypass_cache else cache.get(cache_key)
+        metrics.inc("response_cache_lookups_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            yield CacheHit(cache_key)
+            cached_text, cached_image, cached_mime_type = cached
+            if cached_text:
+                yield TextDelta(cached_text)
+            if cached_image is not None:
+                yield ImagePart(cached_image, cached_mime_type)
+            yield FinishReason("STOP")
+            return
+    
+    hedge_model = (hedge.fallback_model or MODEL) if hedge is not None else MODEL
+    
+    def open_stream(contents, model=MODEL, max_attempts=rate_limit.MAX_ATTEMPTS):
+        # Throttled or transient failures are retried only until the first chunk arrives
+        return rate_limit.call_with_retry(
+            lambda: _open_stream(client, contents, model),
+            limiter=rate_limit.get_limiter("gemini", model),
+            max_attempts=max_attempts
+        )
+    
+    def open_chunks():
+        with metrics.span("build_contents"):
+            contents = builder.build(prompt, messages, images)
+        if hedge is None:
+            return open_stream(contents), hedging.PRIMARY
+        return hedge.run(
+            lambda: open_stream(contents),
+            # The duplicate is a single extra attempt and is not retried
+            lambda: open_stream(contents, hedge_model, max_attempts=1),
+            _ChunkStream.close
         )
-    ]
-    
-    # Add chat history if provided
-    if messages:
-        for message in messages:
-            if message["role"] == "user":
-                # For user messages, we only include text after the first message
-                contents.append(
-                    types.Content(
-                        role="user",
-                        parts=[types.Part.from_text(text=message["content"])]
-                    )
-                )
-            else:
-                # For model responses, we need to handle both text and images
-                if isinstance(message["content"], str):
-                    contents.append(
-                        types.Content(
-                            role="model",
-                            parts=[types.Part.from_text(text=message["content"])]
-                        )
-                    )
-                else:
-                    # This is an image response
-                    contents.append(
-                        types.Content(
-                            role="model",
-                            parts=[
-                                types.Part.from_bytes(
-                                    data=message["content"],
-                                    mime_type=message["mime_type"]
-                                )
-                            ]
-                        )
-                    )
-    
-    # Configure generation
-    generate_content_config = types.GenerateContentConfig(
-        temperature=1,
-        top_p=0.95,
-        top_k=40,
-        max_output_tokens=8192,
-        response_modalities=[
-            "text",
-            "image",
-        ],
-        response_mime_type="text/plain",
-    )
     
-    # Stream response
+    with metrics.span("gemini_first_chunk") as span:
+        try:
+            chunks, winner = open_chunks()
+        except errors.ClientError as e:
+            if file_cache is None or e.code not in (403, 404):
+                raise
+            # A referenced file is gone on the service side: re-upload and retry once
+            file_cache.invalidate()
+            builder.invalidate()
+            chunks, winner = open_chunks()
+        span.set(winner=winner)
+    stream_started = time.perf_counter()
+    
+    if winner == hedging.HEDGE:
+        yield Hedged(hedge_model)
+        if hedge_model != MODEL:
+            # The answer came from the fallback model; don't cache it under MODEL
+            cache_key = None
+    
+    finish_reason = None
+    usage = None
     response_text = ""
     response_image = None
     response_mime_type = None
     
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+    for chunk in chunks:
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+        if not chunk.candidates:
+            continue
+        candidate = chunk.candidates[0]
+        if candidate.finish_reason:
+            finish_reason = candidate.finish_reason
+        if not candidate.content or not candidate.content.parts:
             continue
-            
-        if chunk.candidates[0].content.parts[0].inline_data:
-            # This is an image response
-            response_image = chunk.candidates[0].content.parts[0].inline_data.data
-            response_mime_type = chunk.candidates[0].content.parts[0].inline_data.mime_type
-        else:
-            # This is a text response
-            response_text += chunk.text
-    
-    return response_text, response_image, response_mime_type 
\ No newline at end of file
+        
+        for part in candidate.content.parts:
+            if part.inline_data:
+                # This is an image response
+                response_image = part.inline_data.data
+                response_mime_type = part.inline_data.mime_type
+                yield ImagePart(response_image, response_mime_type)
+            elif part.text:
+                # This is a text response
+                response_text += part.text
+                yield TextDelta(part.text)
+    
+    metrics.observe("gemini_stream_seconds", time.perf_counter() - stream_started)
+    metrics.inc("gemini_response_bytes_total", len(response_text.encode("utf-8")) + len(response_image or b""))
+    
+    finish_name = getattr(finish_reason, "name", str(finish_reason)) if finish_reason is not None else None
+    if cache_key is not None and finish_name in (None, "STOP") and (response_text or response_image is not None):
+        cache.put(cache_key, response_text, response_image, response_mime_type)
+    
+    if finish_name is not None:
+        yield FinishReason(finish_name)
+    if usage is not None:
+        yield Usage(
+            usage.prompt_token_count,
+            usage.candidates_token_count,
+            usage.total_token_count,
+        )
+
+
+def collect_response(events):
+    """Collapse a stream of events into the (text, image, mime_type) tuple
+    
+    Args:
+        events (iterable): Events from stream_response
+        
+    Returns:
+        tuple: (response_text, response_image, response_mime_type)
+    """
+    response_text = ""
+    response_image = None
+    response_mime_type = None
+    
+    for event in events:
+        if isinstance(event, TextDelta):
+            response_text += event.text
+        elif isinstance(event, ImagePart):
+            response_image = event.data
+            response_mime_type = event.mime_type
+    
+    return response_text, response_image, response_mime_type
+
+
+def generate_response(gemini_api_key, prompt, messages=None, images=None, history_budget=None, file_cache=None,
+                      cache=None, bypass_cache=False, hedge=None, builder=None):
+    """Generate a response from Gemini model
+    
+    Args:
+        gemini_api_key (str): The API key for Gemini
+        prompt (str): The text prompt to send to Gemini
+        messages (list, optional): Previous chat history
+        images (list, optional): List of image data dictionaries
+        history_budget (dict, optional): Keyword arguments for history_planner.plan_history
+        file_cache (file_uploads.FileHandleCache, optional): Upload images once and reference them by URI
+        cache (response_cache.ResponseCache, optional): Response cache to read and fill
+        bypass_cache (bool, optional): Skip the cache lookup for this request
+        hedge (hedging.HedgePolicy, optional): Hedge slow requests with a duplicate
+        builder (contents_builder.ContentsBuilder, optional): Reuse contents built for earlier turns
+        
+    Returns:
+        tuple: (response_text, response_image, response_mime_type)
+    """
+    return collect_response(
+        stream_response(
+            gemini_api_key, prompt, messages=messages, images=images,
+            history_budget=history_budget, file_cache=file_cache,
+            cache=cache, bypass_cache=bypass_cache, hedge=hedge, builder=builder
+        )
+    )
@@ -0,0 +1,199 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Defaults for the process-wide policy; override via environment variables
+DEFAULT_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "0.95"))
+DEFAULT_BUDGET = float(os.environ.get("GEMINI_HEDGE_BUDGET", "0.1"))
+DEFAULT_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+DEFAULT_FALLBACK_MODEL = os.environ.get("GEMINI_HEDGE_MODEL") or None
+DEFAULT_WINDOW = 500
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+def _percentile(samples, q):
+    """Nearest-rank percentile of a list of numbers (q in 0..1)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, q):
+        """Return the q-th percentile (0..1) of the window, or None when empty"""
+        with self._lock:
+            samples = list(self._samples)
+        return _percentile(samples, q)
+
+    def summary(self):
+        """Return count, p50, p95 and p99 of the window in seconds"""
+        with self._lock:
+            samples = list(self._samples)
+        return {
+            "count": len(samples),
+            "p50": _percentile(samples, 0.50),
+            "p95": _percentile(samples, 0.95),
+            "p99": _percentile(samples, 0.99),
+        }
+
+
+class HedgePolicy:
+    """Fires a duplicate request when the first one is slower than usual
+
+    ``run`` starts the primary attempt and waits up to the ``percentile`` of
+    recent single-attempt latencies. If nothing has arrived by then (and the
+    budget allows), a hedge attempt is started; whichever opens first wins
+    and the other is discarded as soon as it returns. At most ``budget`` of
+    all requests are hedged, and no hedging happens until ``min_samples``
+    latencies have been seen.
+
+    Two windows are kept for reporting: per-attempt latencies (what requests
+    cost without hedging) and the latency callers actually observed.
+    """
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET, min_samples=DEFAULT_MIN_SAMPLES,
+                 fallback_model=DEFAULT_FALLBACK_MODEL, window=DEFAULT_WINDOW, clock=time.monotonic):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.fallback_model = fallback_model
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.attempts = LatencyTracker(window)
+        self.observed = LatencyTracker(window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def hedge_delay(self):
+        """Seconds to wait for the primary before hedging, or None to never hedge"""
+        if self.attempts.count() < self.min_samples:
+            return None
+        return self.attempts.percentile(self.percentile)
+
+    def _spend(self):
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                self.over_budget += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def run(self, open_primary, open_hedge, discard):
+        """Open a request, hedging it if the primary is slow
+
+        Args:
+            open_primary (callable): Opens the primary attempt; blocks until it
+                is usable (e.g. its first chunk arrived) and returns it
+            open_hedge (callable): Opens the duplicate attempt
+            discard (callable): Called with a losing attempt's result to cancel it
+
+        Returns:
+            tuple: (result, winner) where winner is PRIMARY or HEDGE
+
+        Raises:
+            Exception: The primary's error when every started attempt failed
+        """
+        with self._lock:
+            self.requests += 1
+        started = self._clock()
+        results = queue.Queue()
+        claim_lock = threading.Lock()
+        claimed = []
+
+        def attempt(name, opener):
+            attempt_started = self._clock()
+            try:
+                value = opener()
+            except BaseException as e:
+                results.put((name, None, e))
+                return
+            self.attempts.record(self._clock() - attempt_started)
+            with claim_lock:
+                won = not claimed
+                claimed.append(name)
+            if won:
+                results.put((name, value, None))
+            else:
+                # Too late: the other attempt already won
+                discard(value)
+
+        def launch(name, opener):
+            thread = threading.Thread(target=attempt, args=(name, opener), name=f"gemini-{name}", daemon=True)
+            thread.start()
+
+        launch(PRIMARY, open_primary)
+        pending = 0
+        try:
+            name, value, error = results.get(timeout=self.hedge_delay())
+        except queue.Empty:
+            if self._spend():
+                launch(HEDGE, open_hedge)
+                pending = 1
+            name, value, error = results.get()
+
+        errors = {}
+        if error is not None:
+            errors[name] = error
+            if pending:
+                name, value, error = results.get()
+                if error is not None:
+                    errors[name] = error
+        if error is not None:
+            # Whichever attempt failed first, report the primary's error
+            raise errors[PRIMARY]
+
+        self.observed.record(self._clock() - started)
+        if name == HEDGE:
+            with self._lock:
+                self.hedge_wins += 1
+        return value, name
+
+    def stats(self):
+        """Return hedge counters and tail latency with and without hedging"""
+        with self._lock:
+            counters = {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "over_budget": self.over_budget,
+                "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+            }
+        counters["hedge_delay"] = self.hedge_delay()
+        counters["attempt_latency"] = self.attempts.summary()
+        counters["observed_latency"] = self.observed.summary()
+        return counters
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    """Return the process-wide hedge policy shared by every session"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy()
+        return _policy
@@ -0,0 +1,199 @@
+import os
+
+# Defaults for the request history budget; override via environment variables
+DEFAULT_MAX_BYTES = int(os.environ.get("HISTORY_MAX_BYTES", str(8 * 1024 * 1024)))
+DEFAULT_MAX_TOKENS = int(os.environ.get("HISTORY_MAX_TOKENS", "32000"))
+DEFAULT_KEEP_RECENT = int(os.environ.get("HISTORY_KEEP_RECENT", "6"))
+
+# Rough cost model: ~4 characters per text token, fixed token cost per image
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+# What to do with generated images in turns older than the recent window
+IMAGE_POLICY_ALL = "all"          # keep every image
+IMAGE_POLICY_LATEST = "latest"    # keep only the most recent one (edit chains)
+IMAGE_POLICY_NONE = "none"        # replace all of them with placeholders
+
+IMAGE_PLACEHOLDER = "[Earlier generated image omitted from this request]"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_LINE_CHARS = 160
+
+
+def is_image_message(message):
+    """Return True if a chat message carries an image blob reference rather than text"""
+    return not isinstance(message["content"], str)
+
+
+def message_cost(message):
+    """Estimate the request payload of a single chat message
+
+    Args:
+        message (dict): Chat message with "role" and "content"
+
+    Returns:
+        tuple: (bytes, tokens)
+    """
+    if is_image_message(message):
+        return message["content"]["size"], IMAGE_TOKENS
+    size = len(message["content"].encode("utf-8"))
+    return size, max(1, len(message["content"]) // CHARS_PER_TOKEN)
+
+
+def attached_cost(messages, attach):
+    """Estimate the payload of the uploaded images a request attaches
+
+    Args:
+        messages (list): Chat messages being sent, oldest first
+        attach (callable): Returns (message, image_records) pairs for the
+            messages, e.g. ContentsBuilder.turns bound to the prompt and images
+
+    Returns:
+        tuple: (bytes, tokens)
+    """
+    total_bytes = 0
+    total_tokens = 0
+    for _, records in attach(messages):
+        for img in records:
+            # The downscaled variant is what gets sent, once it exists
+            total_bytes += (img.get("model_blob") or img)["size"]
+            total_tokens += IMAGE_TOKENS
+    return total_bytes, total_tokens
+
+
+def _total_cost(messages, attach=None):
+    total_bytes = 0
+    total_tokens = 0
+    for message in messages:
+        size, tokens = message_cost(message)
+        total_bytes += size
+        total_tokens += tokens
+    if attach is not None:
+        size, tokens = attached_cost(messages, attach)
+        total_bytes += size
+        total_tokens += tokens
+    return total_bytes, total_tokens
+
+
+def summarize_turns(messages):
+    """Collapse turns into a short extractive summary
+
+    Each text turn is cut to its first line (at most SUMMARY_LINE_CHARS
+    characters); image turns are noted but not included.
+
+    Args:
+        messages (list): Chat messages to summarize, oldest first
+
+    Returns:
+        str: Summary text
+    """
+    lines = []
+    for message in messages:
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        if is_image_message(message):
+            lines.append(f"- {speaker}: [generated an image]")
+            continue
+        text = message["content"].strip().splitlines()[0] if message["content"].strip() else ""
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS].rstrip() + "..."
+        lines.append(f"- {speaker}: {text}")
+    return SUMMARY_PREFIX + "\n".join(lines)
+
+
+def _placeholder(message):
+    return {"role": message["role"], "content": IMAGE_PLACEHOLDER}
+
+
+def plan_history(messages, max_bytes=None, max_tokens=None, keep_recent=None,
+                 image_policy=IMAGE_POLICY_LATEST, summarize=None, attach=None):
+    """Fit chat history into a byte and token budget
+
+    The most recent ``keep_recent`` messages are always kept verbatim. Older
+    generated images are replaced with text placeholders according to
+    ``image_policy``. If the history is still over budget, the oldest turns
+    are dropped; when ``summarize`` is given they are collapsed into a single
+    summary message instead.
+
+    Args:
+        messages (list): Chat history, oldest first
+        max_bytes (int, optional): Byte budget. Defaults to DEFAULT_MAX_BYTES
+        max_tokens (int, optional): Token budget. Defaults to DEFAULT_MAX_TOKENS
+        keep_recent (int, optional): Messages kept verbatim. Defaults to DEFAULT_KEEP_RECENT
+        image_policy (str): "all", "latest" or "none"
+        summarize (callable or bool, optional): Callable turning a list of
+            messages into summary text, or True to use summarize_turns
+        attach (callable, optional): Returns the uploaded images each turn
+            carries (see attached_cost); their bytes count against the budget.
+            Which turn carries them can change as turns are dropped, so it is
+            applied to the whole planned history each time.
+
+    Returns:
+        tuple: (planned_messages, report) where report is a dict with the
+        original and planned bytes/tokens, bytes and tokens saved, and counts
+        of replaced images, dropped and summarized turns
+    """
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+    max_tokens = DEFAULT_MAX_TOKENS if max_tokens is None else max_tokens
+    keep_recent = max(1, DEFAULT_KEEP_RECENT if keep_recent is None else keep_recent)
+    if summarize is True:
+        summarize = summarize_turns
+
+    messages = list(messages or [])
+    original_bytes, original_tokens = _total_cost(messages, attach)
+
+    split = max(0, len(messages) - keep_recent)
+    older = messages[:split]
+    recent = messages[split:]
+
+    # Thin out images in the older part of the conversation
+    images_replaced = 0
+    if image_policy != IMAGE_POLICY_ALL:
+        keep_idx = None
+        if image_policy == IMAGE_POLICY_LATEST and not any(is_image_message(m) for m in recent):
+            for idx in range(len(older) - 1, -1, -1):
+                if is_image_message(older[idx]):
+                    keep_idx = idx
+                    break
+        thinned = []
+        for idx, message in enumerate(older):
+            if is_image_message(message) and idx != keep_idx:
+                thinned.append(_placeholder(message))
+                images_replaced += 1
+            else:
+                thinned.append(message)
+        older = thinned
+
+    # Drop the oldest turns until the request fits
+    dropped = []
+    recent_bytes, recent_tokens = _total_cost(recent)
+    older_bytes, older_tokens = _total_cost(older)
+    image_bytes, image_tokens = attached_cost(older + recent, attach) if attach is not None else (0, 0)
+    while older and (recent_bytes + older_bytes + image_bytes > max_bytes
+                     or recent_tokens + older_tokens + image_tokens > max_tokens):
+        message = older.pop(0)
+        size, tokens = message_cost(message)
+        older_bytes -= size
+        older_tokens -= tokens
+        dropped.append(message)
+        if attach is not None:
+            image_bytes, image_tokens = attached_cost(older + recent, attach)
+
+    planned = older + recent
+    if dropped and summarize:
+        planned.insert(0, {"role": "user", "content": summarize(dropped)})
+
+    planned_bytes, planned_tokens = _total_cost(planned, attach)
+    report = {
+        "original_messages": len(messages),
+        "planned_messages": len(planned),
+        "original_bytes": original_bytes,
+        "planned_bytes": planned_bytes,
+        "saved_bytes": original_bytes - planned_bytes,
+        "original_tokens": original_tokens,
+        "planned_tokens": planned_tokens,
+        "saved_tokens": original_tokens - planned_tokens,
+        "images_replaced": images_replaced,
+        "turns_dropped": 0 if summarize else len(dropped),
+        "turns_summarized": len(dropped) if summarize else 0,
+        "over_budget": planned_bytes > max_bytes or planned_tokens > max_tokens,
+    }
+    return planned, report
@@ -0,0 +1,221 @@
+import blob_store
+from blob_store import content_hash
+
+UPLOADED = "uploaded"
+GENERATED = "generated"
+
+
+class ImageStore:
+    """Content-addressed store for uploaded and generated images
+
+    Every image is held once, keyed by the hash of its bytes, with secondary
+    indexes by name and by file path. Lookups and duplicate checks are O(1)
+    instead of scanning every stored image.
+
+    Records are plain dicts with "hash", "name", "mime_type", "size",
+    "file_path" and "kind" ("uploaded" or "generated"). They never hold the
+    image bytes: those live once in the shared blob store and are read on
+    demand through ``get_data``.
+
+    ``on_change`` is called as ``on_change(event, record)`` with event "add"
+    or "remove", e.g. to persist the session's images (see session_store.py).
+
+    While the store is alive, the blob store does not evict the blobs its
+    records (and their downscaled model variants) point to.
+    """
+
+    def __init__(self, blobs=None, on_change=None):
+        self._blobs = blobs
+        self._on_change = on_change
+        self._holding = False
+        self._records = {}
+        self._by_name = {}
+        self._by_path = {}
+        self._order = {UPLOADED: [], GENERATED: []}
+        self._views = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, image_hash):
+        return image_hash in self._records
+
+    def add(self, data, name, kind=UPLOADED, mime_type=None, file_path=None, **extra):
+        """Add an image unless identical bytes are already stored
+
+        Args:
+            data (bytes): Binary image data
+            name (str): Display name of the image
+            kind (str): "uploaded" or "generated"
+            mime_type (str, optional): MIME type of the data
+            file_path (str, optional): Path the image is saved at on disk
+            **extra: Additional fields to keep on the record (e.g. "format")
+
+        Returns:
+            tuple: (record, added) where added is False for a duplicate
+        """
+        image_hash = content_hash(data)
+        existing = self._records.get(image_hash)
+        if existing is not None:
+            return existing, False
+
+        self.blobs.put(data, mime_type)
+        record = dict(extra)
+        record.update({
+            "hash": image_hash,
+            "name": name,
+            "mime_type": mime_type,
+            "size": len(data),
+            "file_path": file_path,
+            "kind": kind,
+        })
+        self._index(record)
+        if self._on_change is not None:
+            self._on_change("add", record)
+        return record, True
+
+    def _index(self, record):
+        if not self._holding:
+            self.blobs.add_holder(self)
+            self._holding = True
+        image_hash = record["hash"]
+        self._records[image_hash] = record
+        self._by_name.setdefault(record["name"], image_hash)
+        if record.get("file_path"):
+            self._by_path.setdefault(record["file_path"], image_hash)
+        self._order[record["kind"]].append(image_hash)
+        self._views.clear()
+
+    def restore(self, records):
+        """Re-add records loaded from a session store
+
+        The bytes are expected in the blob store already; records whose blob
+        is missing are skipped. ``on_change`` is not called.
+
+        Returns:
+            int: The number of records restored
+        """
+        restored = 0
+        for record in records:
+            if record["hash"] in self._records or not self.blobs.exists(record["hash"]):
+                continue
+            self._index(dict(record))
+            restored += 1
+        return restored
+
+    def add_record(self, record, kind=UPLOADED):
+        """Add a record produced by ``utils.process_uploaded_image``
+
+        Returns:
+            tuple: (record, added) where added is False for a duplicate
+        """
+        fields = dict(record)
+        data = fields.pop("data")
+        name = fields.pop("name")
+        return self.add(data, name, kind=kind, **fields)
+
+    def get(self, image_hash):
+        """Return the record for a content hash, or None"""
+        return self._records.get(image_hash)
+
+    def get_by_name(self, name):
+        """Return the record with the given name, or None"""
+        image_hash = self._by_name.get(name)
+        return self._records.get(image_hash) if image_hash else None
+
+    def get_by_path(self, file_path):
+        """Return the record saved at the given file path, or None"""
+        image_hash = self._by_path.get(file_path)
+        return self._records.get(image_hash) if image_hash else None
+
+    @property
+    def blobs(self):
+        """The blob store holding the image bytes"""
+        if self._blobs is None:
+            self._blobs = blob_store.get_blob_store()
+        return self._blobs
+
+    def blob_hashes(self):
+        """Return the blob hashes this store's records reference"""
+        hashes = list(self._records)
+        for record in list(self._records.values()):
+            if record.get("model_blob"):
+                hashes.append(record["model_blob"]["hash"])
+        return hashes
+
+    def missing(self, records):
+        """Return the records among ``records`` whose bytes can no longer be read
+
+        An image whose original is gone still counts as available while its
+        downscaled model variant is stored.
+        """
+        return [
+            record for record in records
+            if not self.blobs.exists(record["hash"])
+            and not (record.get("model_blob") and self.blobs.exists(record["model_blob"]["hash"]))
+        ]
+
+    def blob_ref(self, image_hash):
+        """Return a blob reference for a stored image, or None"""
+        record = self._records.get(image_hash)
+        if record is None:
+            return None
+        return self.blobs.ref(image_hash, record["size"], record["mime_type"])
+
+    def get_data(self, image_hash):
+        """Return the bytes for a content hash, or None, reading them lazily"""
+        if image_hash not in self._records:
+            return None
+        return self.blobs.read(image_hash)
+
+    def remove(self, image_hash):
+        """Remove an image and its index entries
+
+        Returns:
+            dict or None: The removed record
+        """
+        record = self._records.pop(image_hash, None)
+        if record is None:
+            return None
+        if self._by_name.get(record["name"]) == image_hash:
+            del self._by_name[record["name"]]
+        if record.get("file_path") and self._by_path.get(record["file_path"]) == image_hash:
+            del self._by_path[record["file_path"]]
+        self._order[record["kind"]].remove(image_hash)
+        self._views.clear()
+        if self._on_change is not None:
+            self._on_change("remove", record)
+        return record
+
+    def clear(self, kind=None):
+        """Remove every image, or only those of the given kind"""
+        kinds = [kind] if kind else list(self._order)
+        for k in kinds:
+            for image_hash in list(self._order[k]):
+                self.remove(image_hash)
+
+    def _view(self, key, kinds):
+        view = self._views.get(key)
+        if view is None:
+            view = [self._records[h] for k in kinds for h in self._order[k]]
+            self._views[key] = view
+        return view
+
+    def uploaded(self):
+        """Return uploaded image records in upload order"""
+        return self._view(UPLOADED, (UPLOADED,))
+
+    def generated(self):
+        """Return generated image records in generation order"""
+        return self._view(GENERATED, (GENERATED,))
+
+    def all(self):
+        """Return uploaded followed by generated image records
+
+        The list is cached until the store changes, so reruns don't rebuild it.
+        """
+        return self._view("all", (UPLOADED, GENERATED))
+
+    def names(self):
+        """Return the names of all images, uploaded first"""
+        return [record["name"] for record in self.all()]
@@ -0,0 +1,98 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import blob_store
+import thumbnails
+import utils
+from blob_store import content_hash
+
+# Worker threads shared by every session; PIL releases the GIL while decoding
+# and encoding, so threads scale without pickling image bytes to processes
+DEFAULT_WORKERS = int(os.environ.get("INGEST_WORKERS", str(min(8, os.cpu_count() or 2))))
+
+# An upload waiting to be ingested; the hash is of the raw file bytes
+PendingUpload = namedtuple("PendingUpload", ["name", "data", "hash"])
+
+# Outcome of ingesting one upload: record is None when error is set
+IngestResult = namedtuple("IngestResult", ["name", "hash", "record", "thumbnail", "error"])
+
+
+def pending_uploads(files, image_store, skip_hashes=()):
+    """Return the uploads that still need ingesting, without decoding anything
+
+    Files are skipped when an image with the same name is stored (as
+    before), when identical bytes are already stored or listed earlier in
+    the same batch, or when their hash is in ``skip_hashes`` (e.g. files
+    that previously failed to decode).
+
+    Args:
+        files (list): Streamlit UploadedFile objects (anything with name and getvalue())
+        image_store (ImageStore): The session's image store
+        skip_hashes (iterable, optional): Raw-byte hashes to leave out
+
+    Returns:
+        list: PendingUpload tuples in upload order
+    """
+    pending = []
+    seen = set(skip_hashes)
+    for uploaded_file in files:
+        if utils.is_duplicate_image(uploaded_file.name, image_store):
+            continue
+        data = uploaded_file.getvalue()
+        image_hash = content_hash(data)
+        if image_hash in image_store or image_hash in seen:
+            continue
+        seen.add(image_hash)
+        pending.append(PendingUpload(uploaded_file.name, data, image_hash))
+    return pending
+
+
+def ingest_one(upload, blobs=None, thumbnail_size=thumbnails.GALLERY_SIZE):
+    """Decode, validate, re-encode and store one upload; runs on a worker thread
+
+    The original bytes and the model variant are written to the blob store
+    and the gallery thumbnail is cached, so adding the record to the image
+    store afterwards is cheap.
+
+    Returns:
+        IngestResult: The record (or the error) and the gallery thumbnail
+    """
+    try:
+        record = utils.process_image_bytes(upload.name, upload.data)
+        (blobs or blob_store.get_blob_store()).put(upload.data, record["mime_type"])
+        thumbnail = thumbnails.get_thumbnail(upload.hash, thumbnail_size, lambda: upload.data)
+        return IngestResult(upload.name, upload.hash, record, thumbnail, None)
+    except Exception as e:
+        return IngestResult(upload.name, upload.hash, None, None, str(e))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide ingestion thread pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="ingest")
+        return _executor
+
+
+def ingest(uploads, blobs=None, executor=None):
+    """Ingest uploads in parallel, yielding each result as soon as it is ready
+
+    Args:
+        uploads (list): PendingUpload tuples from pending_uploads
+        blobs (BlobStore, optional): Blob store to write to (the process-wide one by default)
+        executor (Executor, optional): Pool to run on (the process-wide one by default)
+
+    Yields:
+        IngestResult: In completion order
+    """
+    executor = executor or get_executor()
+    futures = [executor.submit(ingest_one, upload, blobs) for upload in uploads]
+    for future in as_completed(futures):
+        yield future.result()
@@ -0,0 +1,251 @@
+import mimetypes
+import os
+import re
+import threading
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import artifact_store
+
+# Serve generated files over HTTP instead of through Streamlit's media manager.
+# Off by default; the browser must be able to reach MEDIA_BASE_URL.
+ENABLED = os.environ.get("MEDIA_SERVER", "").lower() in ("1", "true", "yes")
+DEFAULT_BIND = os.environ.get("MEDIA_BIND", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("MEDIA_PORT", "8502"))
+DEFAULT_BASE_URL = os.environ.get("MEDIA_BASE_URL") or None
+# Artifact names are unique (uuid or content hash), so their bytes never change
+DEFAULT_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", str(24 * 60 * 60)))
+
+CHUNK_SIZE = 256 * 1024
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Files that are still being written
+_INCOMPLETE_SUFFIXES = (".part", ".tmp")
+# Only files directly inside a session's own artifact directory (named by
+# app.py with uuid4().hex) are served; shared namespaces such as the video
+# result cache, whose names derive from prompts, are not
+_SESSION_DIR = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _servable(root, path):
+    """Return True if path is a file name directly inside a session directory under root"""
+    if os.path.commonpath([path, root]) != root:
+        return False
+    parts = os.path.relpath(path, root).split(os.sep)
+    return len(parts) == 2 and _SESSION_DIR.match(parts[0]) is not None
+
+
+def _etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """Parse a single-range Range header
+
+    Returns:
+        tuple or None: (start, end) inclusive, None to serve the whole file
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None:
+        # Absent, malformed or multi-range: serving the full file is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    server_version = "ImageChatMedia/1.0"
+
+    def _resolve(self):
+        """Map the request path to a file inside the root, or None"""
+        relative = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+        path = os.path.realpath(os.path.join(self.server.root, relative))
+        if not _servable(self.server.root, path):
+            return None
+        if path.endswith(_INCOMPLETE_SUFFIXES) or not os.path.isfile(path):
+            return None
+        return path
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        path = self._resolve()
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            file = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        with file:
+            stat = os.fstat(file.fileno())
+            size = stat.st_size
+            etag = _etag(stat)
+
+            if self._not_modified(etag, stat):
+                self.send_response(304)
+                self._send_cache_headers(etag, stat)
+                self.end_headers()
+                return
+
+            byte_range = None
+            if_range = self.headers.get("If-Range")
+            if if_range is None or if_range == etag:
+                try:
+                    byte_range = parse_range(self.headers.get("Range"), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+            start, end = byte_range if byte_range else (0, size - 1)
+            length = max(0, end - start + 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self._send_cache_headers(etag, stat)
+            self.end_headers()
+
+            # Keep served artifacts from being evicted as idle
+            artifact_store.touch_file(path)
+            if not send_body:
+                return
+            file.seek(start)
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = file.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # The browser cancelled (e.g. seeking in a video)
+                pass
+
+    def _not_modified(self, etag, stat):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_cache_headers(self, etag, stat):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.send_header("Cache-Control", f"private, max-age={self.server.max_age}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    """Range-capable static file server for generated media
+
+    Serves files in the session directories under ``root`` (the artifact
+    store) with ETag,
+    Last-Modified, Cache-Control and byte-range support. The browser can then
+    cache and seek images and videos itself, instead of Streamlit holding
+    each file in memory and pushing it over every session's websocket.
+    """
+
+    def __init__(self, root, host=DEFAULT_BIND, port=DEFAULT_PORT, base_url=DEFAULT_BASE_URL, max_age=DEFAULT_MAX_AGE):
+        self.root = os.path.realpath(root)
+        self.host = host
+        self.port = port
+        self.max_age = max_age
+        self._base_url = base_url
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        if self._base_url:
+            return self._base_url.rstrip("/")
+        host = "localhost" if self.host in ("0.0.0.0", "127.0.0.1", "") else self.host
+        return f"http://{host}:{self.port}"
+
+    def start(self):
+        """Start serving on a background thread"""
+        if self._httpd is not None:
+            return
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _MediaHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.root = self.root
+        self._httpd.max_age = self.max_age
+        if not self.port:
+            # Port 0 picks a free port
+            self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="media-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def url_for(self, path):
+        """Return the URL of a file in a session directory, or None if it is not served"""
+        path = os.path.realpath(path)
+        if not _servable(self.root, path):
+            return None
+        relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+        return f"{self.base_url}/{urllib.parse.quote(relative)}"
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_media_server():
+    """Return the process-wide media server, starting it on first use, or None when disabled"""
+    global _server
+    if not ENABLED:
+        return None
+    with _server_lock:
+        if _server is None:
+            server = MediaServer(artifact_store.get_artifact_store().root)
+            server.start()
+            _server = server
+        return _server
+
+
+def media_source(path):
+    """Return what to pass to st.image/st.video for a file: its URL when serving, else the path"""
+    server = get_media_server()
+    if server is not None:
+        url = server.url_for(path)
+        if url is not None:
+            return url
+    return path
@@ -0,0 +1,272 @@
+"""Lightweight latency and counter metrics
+
+Disabled unless METRICS_ENABLED is set. When disabled, ``span`` returns a
+shared no-op object and the other functions return immediately, so
+instrumented code pays only a function call and a flag check.
+
+Usage:
+    with metrics.span("gemini_first_chunk", model=MODEL):
+        ...
+    metrics.inc("gemini_request_bytes_total", len(payload))
+
+Export:
+    metrics.prometheus_text()       # Prometheus text exposition format
+    metrics.snapshot()              # JSON-serializable dict
+    METRICS_JSONL=path              # append every observation as a JSON line
+    METRICS_PORT=9108               # serve /metrics and /metrics.json over HTTP
+"""
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+JSONL_PATH = os.environ.get("METRICS_JSONL") or None
+HTTP_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Histogram upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Registry:
+    """Thread-safe store of counters and histograms keyed by name and labels"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, jsonl_path=None, clock=time.time):
+        self.buckets = tuple(buckets)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+
+    def _log(self, kind, name, value, key):
+        if self._jsonl is None:
+            return
+        line = json.dumps({"ts": self._clock(), "type": kind, "name": name, "value": value, "labels": dict(key)})
+        with self._lock:
+            self._jsonl.write(line + "\n")
+            self._jsonl.flush()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._counters[(name, key)] = self._counters.get((name, key), 0) + value
+        self._log("counter", name, value, key)
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            histogram = self._histograms.get((name, key))
+            if histogram is None:
+                histogram = self._histograms[(name, key)] = _Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.sum += value
+            histogram.count += 1
+        self._log("histogram", name, value, key)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Return every metric as a JSON-serializable dict"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(key), "value": value}
+                for (name, key), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(key),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], h.counts)),
+                }
+                for (name, key), h in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format"""
+        def fmt(labels, extra=None):
+            items = list(labels) + ([extra] if extra else [])
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, key), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{fmt(key)} {value}")
+            for (name, key), h in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt(key, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{fmt(key)} {h.sum}")
+                lines.append(f"{name}_count{fmt(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    """Times a block and records it as ``<name>_seconds``
+
+    Labels can be added while the span is open with ``set`` (e.g. whether a
+    cache hit). A span left by an exception is labelled ``error="true"``.
+    """
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def set(self, **labels):
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.labels["error"] = "true"
+        self.registry.observe(f"{self.name}_seconds", time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **labels):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+_registry = Registry(jsonl_path=JSONL_PATH if ENABLED else None)
+
+
+def get_registry():
+    """Return the process-wide metrics registry"""
+    return _registry
+
+
+def span(name, **labels):
+    """Return a context manager timing a block (a no-op when disabled)"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(_registry, name, labels)
+
+
+def timed(name, **labels):
+    """Decorator timing every call of a function as a span"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(_registry, name, dict(labels)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    if ENABLED:
+        _registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Record a value (in seconds) in a histogram"""
+    if ENABLED:
+        _registry.observe(name, value, **labels)
+
+
+def snapshot():
+    return _registry.snapshot()
+
+
+def prometheus_text():
+    return _registry.prometheus_text()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port=HTTP_PORT, host="127.0.0.1"):
+    """Serve /metrics and /metrics.json on a background thread (once per process)
+
+    Returns:
+        ThreadingHTTPServer or None: The server, or None when disabled or no port is set
+    """
+    global _server
+    if not ENABLED or not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            thread = threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True)
+            thread.start()
+        return _server
@@ -0,0 +1,319 @@
+import contextlib
+import email.utils
+import json
+import os
+import random
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: the file backend is unavailable
+    fcntl = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+# Requests per minute per provider and model; 0 disables limiting.
+# Override with RATE_LIMIT_<PROVIDER>_RPM, e.g. RATE_LIMIT_GEMINI_RPM=10
+DEFAULT_RPM = {
+    "gemini": 60,
+    "replicate": 600,
+}
+DEFAULT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "5"))
+
+# "memory" keeps buckets per process; "file" shares them between processes
+# (replicas on one host or a shared volume) through locked files in RATE_LIMIT_DIR
+BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+DEFAULT_DIR = os.environ.get("RATE_LIMIT_DIR") or os.path.join(os.getcwd(), "rate_limits")
+
+# Retry policy for throttled (429) and transient (5xx, network) failures
+MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "4"))
+BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "1"))
+MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "30"))
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+_transient = [ConnectionError, TimeoutError]
+if httpx is not None:
+    _transient.append(httpx.TransportError)
+if requests is not None:
+    _transient.extend([requests.exceptions.ConnectionError, requests.exceptions.Timeout])
+TRANSIENT_ERRORS = tuple(_transient)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that makes callers wait their turn
+
+    Tokens refill at ``rate`` per second up to ``capacity``. ``acquire``
+    reserves a token immediately (letting the balance go negative) and sleeps
+    until it is due, so waiting callers are served in arrival order and the
+    request rate stays at the ceiling instead of bursting. ``pause`` holds
+    every caller back, e.g. for the Retry-After of a 429.
+
+    Subclasses share the bucket elsewhere by overriding ``_locked_state``.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 0)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._state = self._initial_state()
+        self._stats_lock = threading.Lock()
+        self.acquired = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retries = 0
+        self.throttled = 0
+        self.gave_up = 0
+
+    def _initial_state(self):
+        return {"tokens": self.capacity, "updated": self._clock(), "blocked_until": 0.0}
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        """Yield the mutable bucket state while holding its lock"""
+        with self._lock:
+            yield self._state
+
+    def _reserve(self):
+        """Take a token and return the seconds until it may be used"""
+        if not self.rate:
+            return 0.0
+        with self._locked_state() as state:
+            now = self._clock()
+            tokens = min(self.capacity, state["tokens"] + max(0.0, now - state["updated"]) * self.rate)
+            delay = max(0.0, (1 - tokens) / self.rate, state["blocked_until"] - now)
+            state["tokens"] = tokens - 1
+            state["updated"] = now
+        return delay
+
+    def acquire(self):
+        """Block until a request may be sent
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        delay = self._reserve()
+        if delay > 0:
+            with self._stats_lock:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                self._sleep(delay)
+            finally:
+                with self._stats_lock:
+                    self.waiting -= 1
+        with self._stats_lock:
+            self.acquired += 1
+            self.total_wait += delay
+            self.max_wait = max(self.max_wait, delay)
+        return delay
+
+    def pause(self, seconds):
+        """Hold back every caller for the given number of seconds"""
+        with self._locked_state() as state:
+            state["blocked_until"] = max(state["blocked_until"], self._clock() + seconds)
+
+    def record_retry(self, throttled):
+        with self._stats_lock:
+            self.retries += 1
+            if throttled:
+                self.throttled += 1
+
+    def record_give_up(self):
+        with self._stats_lock:
+            self.gave_up += 1
+
+    def stats(self):
+        """Return queue depth, wait time and retry counters"""
+        with self._stats_lock:
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "acquired": self.acquired,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "avg_wait_seconds": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "gave_up": self.gave_up,
+            }
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket whose state lives in a file guarded by an exclusive lock
+
+    Every process pointing at the same file (replicas on one host or on a
+    shared volume) draws from one budget. Times are wall-clock so they agree
+    across processes.
+    """
+
+    def __init__(self, path, rate, capacity=None, clock=time.time, sleep=time.sleep):
+        if fcntl is None:
+            raise RuntimeError("The file rate-limit backend requires fcntl (not available on this platform)")
+        self.path = path
+        super().__init__(rate, capacity=capacity, clock=clock, sleep=sleep)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with self._lock, open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else self._initial_state()
+                except ValueError:
+                    state = self._initial_state()
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def error_status(exc):
+    """Return the HTTP status carried by an SDK exception, if any"""
+    for attr in ("code", "status_code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def retry_after(exc):
+    """Return the Retry-After delay (seconds) of a failed request, if given"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    """Return True for throttling, transient server errors and network failures"""
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return True
+    return error_status(exc) in RETRYABLE_STATUSES
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY, rng=random.random):
+    """Full-jitter exponential backoff for a zero-based retry attempt"""
+    return rng() * min(max_delay, base_delay * (2 ** attempt))
+
+
+def call_with_retry(func, limiter=None, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                    on_retry=None, sleep=time.sleep):
+    """Call func, waiting on a limiter and retrying transient failures
+
+    Retries use jittered exponential backoff, or the server's Retry-After
+    when it sends one (a 429's Retry-After also pauses the whole limiter so
+    other callers back off too). A Retry-After longer than max_delay is not
+    waited out; the error is raised instead.
+
+    Args:
+        func (callable): Zero-argument callable performing one request
+        limiter (TokenBucket, optional): Bucket to take a token from before each attempt
+        max_attempts (int, optional): Total attempts including the first
+        base_delay (float, optional): Backoff base in seconds
+        max_delay (float, optional): Cap on a single backoff in seconds
+        on_retry (callable, optional): Called as on_retry(attempt, delay, exc) before sleeping
+
+    Returns:
+        object: What func returned
+
+    Raises:
+        Exception: The last error, once it is not retryable or attempts run out
+    """
+    for attempt in range(max_attempts):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if attempt == max_attempts - 1:
+                if limiter is not None:
+                    limiter.record_give_up()
+                raise
+            throttled = error_status(e) == 429
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            elif delay > max_delay:
+                # Waiting that long would stall the caller; surface the error instead
+                if limiter is not None:
+                    limiter.pause(delay)
+                    limiter.record_give_up()
+                raise
+            elif limiter is not None and throttled:
+                limiter.pause(delay)
+            if limiter is not None:
+                limiter.record_retry(throttled)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            sleep(delay)
+
+
+# Process-wide buckets keyed by (provider, model)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _rpm_for(provider):
+    env_value = os.environ.get(f"RATE_LIMIT_{provider.upper()}_RPM")
+    return float(env_value) if env_value is not None else float(DEFAULT_RPM.get(provider, 0))
+
+
+def get_limiter(provider, model):
+    """Return the shared token bucket for a provider and model"""
+    key = (provider, model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rate = _rpm_for(provider) / 60.0
+            capacity = min(DEFAULT_BURST, max(1.0, rate * 60)) if rate else None
+            if BACKEND == "file" and fcntl is not None:
+                safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+                path = os.path.join(DEFAULT_DIR, f"{provider}-{safe_model}.json")
+                limiter = FileTokenBucket(path, rate, capacity=capacity)
+            else:
+                limiter = TokenBucket(rate, capacity=capacity)
+            _limiters[key] = limiter
+        return limiter
+
+
+def limiter_stats():
+    """Return the stats of every shared limiter, keyed by provider/model"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in limiters.items()}
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the process-wide cache; override via environment variables
+DEFAULT_DIR = os.environ.get("RESPONSE_CACHE_DIR") or os.path.join(os.getcwd(), "response_cache")
+DEFAULT_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
+DEFAULT_MEMORY_BYTES = int(os.environ.get("RESPONSE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_DISK_BYTES = int(os.environ.get("RESPONSE_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+# Files younger than this may belong to a put that is still writing
+GRACE_SECONDS = 60
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Normalize a prompt for cache keying (trim and collapse whitespace)"""
+    return _WHITESPACE.sub(" ", prompt or "").strip()
+
+
+def make_key(model, config, prompt, messages=None, image_hashes=None):
+    """Build the cache key for a Gemini request
+
+    Args:
+        model (str): Model name
+        config (dict): Generation config
+        prompt (str): Prompt text
+        messages (list, optional): Conversation sent with the request; image
+            messages contribute their content hash rather than their bytes
+        image_hashes (list, optional): Content hashes of attached images
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    prefix = []
+    for message in messages or []:
+        content = message["content"]
+        if isinstance(content, str):
+            prefix.append([message["role"], "text", content])
+        else:
+            prefix.append([message["role"], "image", content["hash"]])
+    payload = {
+        "model": model,
+        "config": config,
+        "prompt": normalize_prompt(prompt),
+        "messages": prefix,
+        "images": list(image_hashes or []),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) cache of Gemini responses
+
+    Entries hold the response text and, if any, the generated image with its
+    MIME type. Both tiers expire entries after ``ttl_seconds`` and are
+    bounded by bytes (``memory_bytes`` and ``disk_bytes``), evicting the
+    least recently used entries first.
+
+    The disk tier keeps a running index of entry sizes in access order, built
+    by one scan of the directory at startup, so a put never lists the
+    directory. Entries written by other processes join the index when they
+    are first read.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 memory_bytes=DEFAULT_MEMORY_BYTES, disk_bytes=DEFAULT_DISK_BYTES, clock=time.time):
+        self.directory = os.path.abspath(directory)
+        self.ttl_seconds = ttl_seconds
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._index = OrderedDict()
+        self._disk_used = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Index complete entries on disk, oldest access first
+
+        A .bin without its .json is removed only once it is older than
+        GRACE_SECONDS, so a put still between its two writes is left alone.
+        """
+        now = self._clock()
+        entries = {}
+        for item in os.scandir(self.directory):
+            key, ext = os.path.splitext(item.name)
+            if ext not in (".json", ".bin"):
+                continue
+            stat = item.stat()
+            entry = entries.setdefault(key, {"bytes": 0, "atime": None, "mtime": stat.st_mtime})
+            entry["bytes"] += stat.st_size
+            entry["mtime"] = max(entry["mtime"], stat.st_mtime)
+            if ext == ".json":
+                entry["atime"] = stat.st_mtime
+        for key, entry in sorted(entries.items(), key=lambda kv: kv[1]["atime"] or 0):
+            if entry["atime"] is None:
+                if now - entry["mtime"] > GRACE_SECONDS:
+                    self._remove_files(key)
+                continue
+            self._index[key] = {"bytes": entry["bytes"], "atime": entry["atime"]}
+            self._disk_used += entry["bytes"]
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".bin"
+
+    def get(self, key):
+        """Return a cached response, or None
+
+        Returns:
+            tuple or None: (response_text, response_image, response_mime_type)
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry["created"] <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry["value"]
+                self._forget(key)
+
+        meta_path, data_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if now - meta["created"] > self.ttl_seconds:
+                self._remove_files(key)
+                with self._lock:
+                    self._unindex(key)
+                    self.misses += 1
+                return None
+            image = None
+            if meta.get("has_image"):
+                with open(data_path, "rb") as f:
+                    image = f.read()
+            # Bump the access time so disk eviction is least-recently-used
+            os.utime(meta_path)
+            meta_bytes = os.path.getsize(meta_path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        value = (meta["text"], image, meta.get("mime_type"))
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, value, meta["created"])
+            self._index_entry(key, meta_bytes + len(image or b""), now)
+        return value
+
+    def _remember(self, key, value, created):
+        """Insert into the memory tier; caller must hold the lock"""
+        self._forget(key)
+        size = len(value[0].encode("utf-8")) + len(value[1] or b"")
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = {"value": value, "created": created, "bytes": size}
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_used -= old["bytes"]
+
+    def _forget(self, key):
+        """Remove a key from the memory tier; caller must hold the lock"""
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_used -= entry["bytes"]
+
+    def _index_entry(self, key, size, atime):
+        """Record a disk entry as most recently used; caller must hold the lock"""
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._disk_used -= old["bytes"]
+        self._index[key] = {"bytes": size, "atime": atime}
+        self._disk_used += size
+
+    def _unindex(self, key):
+        """Drop a disk entry from the index; caller must hold the lock"""
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._disk_used -= old["bytes"]
+
+    def put(self, key, response_text, response_image=None, response_mime_type=None):
+        """Store a response in both tiers"""
+        created = self._clock()
+        value = (response_text, response_image, response_mime_type)
+        with self._lock:
+            self._remember(key, value, created)
+
+        meta = {
+            "created": created,
+            "text": response_text,
+            "mime_type": response_mime_type,
+            "has_image": response_image is not None,
+        }
+        encoded = json.dumps(meta).encode("utf-8")
+        size = len(encoded) + len(response_image or b"")
+        if size > self.disk_bytes:
+            # Would evict everything else and then itself
+            return
+        meta_path, data_path = self._paths(key)
+        if response_image is not None:
+            self._atomic_write(data_path, response_image)
+        self._atomic_write(meta_path, encoded)
+        with self._lock:
+            self._index_entry(key, size, created)
+        self._enforce_disk_budget()
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove_files(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _enforce_disk_budget(self):
+        """Drop expired, then least recently used entries until under disk_bytes
+
+        Works from the index, oldest access first, and stops at the first
+        entry that is neither expired nor needed to get under the budget.
+        """
+        now = self._clock()
+        evicted = []
+        with self._lock:
+            while self._index:
+                key, entry = next(iter(self._index.items()))
+                if now - entry["atime"] <= self.ttl_seconds and self._disk_used <= self.disk_bytes:
+                    break
+                self._unindex(key)
+                self._forget(key)
+                self.evictions += 1
+                evicted.append(key)
+        for key in evicted:
+            self._remove_files(key)
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            self._index.clear()
+            self._disk_used = 0
+        for item in os.scandir(self.directory):
+            if item.name.endswith((".json", ".bin")):
+                os.remove(item.path)
+
+    def stats(self):
+        """Return tier sizes and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_entries": len(self._index),
+                "disk_bytes": self._disk_used,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache shared by every session"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
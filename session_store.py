@@ -0,0 +1,369 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# "sqlite" (default), "memory" (per process, survives browser reloads only) or "none"
+BACKEND = os.environ.get("SESSION_STORE", "sqlite").lower()
+DEFAULT_DB_PATH = os.environ.get("SESSION_DB_PATH") or os.path.join(os.getcwd(), "sessions.db")
+# Most recent messages loaded when a session is resumed; older ones load on demand
+DEFAULT_RESUME_MESSAGES = int(os.environ.get("SESSION_RESUME_MESSAGES", "100"))
+# Sessions not written to for this long are deleted
+DEFAULT_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+# Expired sessions are looked for at most this often, when a session is created
+EXPIRE_INTERVAL = 60 * 60
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    id TEXT,
+    role TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE TABLE IF NOT EXISTS images (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    hash TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (session_id, hash)
+);
+CREATE TABLE IF NOT EXISTS state (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (session_id, key)
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+"""
+
+
+def is_valid_session_id(session_id):
+    """Return True for ids this app generates (32 hex characters)"""
+    return isinstance(session_id, str) and _SESSION_ID.match(session_id) is not None
+
+
+class MemorySessionStore:
+    """In-process session store, for tests and single-process development
+
+    Defines the backend interface: sessions hold an append-only message log
+    (numbered by ``seq``), image records keyed by content hash, and small
+    JSON state values. Rows never hold image bytes; messages and records only
+    carry blob references.
+
+    Sessions not written to for ``ttl_seconds`` are expired: they no longer
+    exist for resuming, and are deleted by ``expire_sessions``, which
+    ``create_session`` runs at most every EXPIRE_INTERVAL seconds.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_expire = None
+
+    def create_session(self, session_id):
+        """Create a session, or mark an existing one written so it doesn't expire now"""
+        now = self._clock()
+        with self._lock:
+            self._sessions.setdefault(
+                session_id, {"messages": [], "images": {}, "state": {}, "created": now, "updated": now}
+            )["updated"] = now
+            due = self._last_expire is None or now - self._last_expire >= EXPIRE_INTERVAL
+        if due:
+            self.expire_sessions()
+
+    def session_exists(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session is not None and self._clock() - session["updated"] <= self.ttl_seconds
+
+    def _touch(self, session_id):
+        """Return the session's dict and mark it written; caller must hold the lock"""
+        session = self._sessions[session_id]
+        session["updated"] = self._clock()
+        return session
+
+    def append_message(self, session_id, message):
+        """Append a message and return its seq"""
+        with self._lock:
+            log = self._touch(session_id)["messages"]
+            seq = log[-1][0] + 1 if log else 1
+            log.append((seq, json.loads(json.dumps(message, default=str))))
+            return seq
+
+    def load_messages(self, session_id, before_seq=None, limit=None):
+        """Return (seq, message) pairs in order, the last ``limit`` before ``before_seq``"""
+        with self._lock:
+            log = self._sessions.get(session_id, {}).get("messages", [])
+            rows = [row for row in log if before_seq is None or row[0] < before_seq]
+        return rows[-limit:] if limit else rows
+
+    def clear_messages(self, session_id):
+        with self._lock:
+            self._touch(session_id)["messages"] = []
+
+    def put_image(self, session_id, record):
+        with self._lock:
+            self._touch(session_id)["images"][record["hash"]] = dict(record)
+
+    def remove_image(self, session_id, image_hash):
+        with self._lock:
+            self._touch(session_id)["images"].pop(image_hash, None)
+
+    def load_images(self, session_id):
+        with self._lock:
+            return [dict(record) for record in self._sessions.get(session_id, {}).get("images", {}).values()]
+
+    def save_state(self, session_id, key, value):
+        with self._lock:
+            self._touch(session_id)["state"][key] = json.loads(json.dumps(value, default=str))
+
+    def load_state(self, session_id, key):
+        with self._lock:
+            return self._sessions.get(session_id, {}).get("state", {}).get(key)
+
+    def delete_session(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def expire_sessions(self):
+        """Delete sessions not written to for ttl_seconds; returns how many"""
+        now = self._clock()
+        with self._lock:
+            self._last_expire = now
+            expired = [sid for sid, session in self._sessions.items() if now - session["updated"] > self.ttl_seconds]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+
+class SQLiteSessionStore:
+    """Session store in a SQLite database in WAL mode
+
+    Every replica pointing at the same database file (with the blob store and
+    artifact store on shared storage too) can resume any session. Each turn
+    is one small INSERT, not a rewrite of the whole conversation, and
+    history is read a page at a time. Sessions expire as in
+    MemorySessionStore; deleting a session row cascades to its messages,
+    images and state.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.path = os.path.abspath(path)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._local = threading.local()
+        self._expire_lock = threading.Lock()
+        self._last_expire = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn, session_id):
+        conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (self._clock(), session_id))
+
+    def create_session(self, session_id):
+        """Create a session, or mark an existing one written so it doesn't expire now"""
+        now = self._clock()
+        self._connection().execute(
+            "INSERT INTO sessions (id, created, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET updated = excluded.updated",
+            (session_id, now, now)
+        )
+        with self._expire_lock:
+            due = self._last_expire is None or now - self._last_expire >= EXPIRE_INTERVAL
+            if due:
+                self._last_expire = now
+        if due:
+            self.expire_sessions()
+
+    def session_exists(self, session_id):
+        row = self._connection().execute(
+            "SELECT 1 FROM sessions WHERE id = ? AND updated >= ?", (session_id, self._clock() - self.ttl_seconds)
+        ).fetchone()
+        return row is not None
+
+    def append_message(self, session_id, message):
+        """Append a message and return its seq"""
+        conn = self._connection()
+        body = json.dumps(message, default=str)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO messages (session_id, seq, id, role, body) VALUES (?, ?, ?, ?, ?)",
+                (session_id, seq, message.get("id"), message["role"], body)
+            )
+            self._touch(conn, session_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return seq
+
+    def load_messages(self, session_id, before_seq=None, limit=None):
+        """Return (seq, message) pairs in order, the last ``limit`` before ``before_seq``"""
+        query = "SELECT seq, body FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connection().execute(query, params).fetchall()
+        return [(seq, json.loads(body)) for seq, body in reversed(rows)]
+
+    def clear_messages(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._touch(conn, session_id)
+
+    def put_image(self, session_id, record):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO images (session_id, hash, body) VALUES (?, ?, ?)",
+            (session_id, record["hash"], json.dumps(record, default=str))
+        )
+        self._touch(conn, session_id)
+
+    def remove_image(self, session_id, image_hash):
+        conn = self._connection()
+        conn.execute("DELETE FROM images WHERE session_id = ? AND hash = ?", (session_id, image_hash))
+        self._touch(conn, session_id)
+
+    def load_images(self, session_id):
+        rows = self._connection().execute(
+            "SELECT body FROM images WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def save_state(self, session_id, key, value):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO state (session_id, key, body) VALUES (?, ?, ?)",
+            (session_id, key, json.dumps(value, default=str))
+        )
+        self._touch(conn, session_id)
+
+    def load_state(self, session_id, key):
+        row = self._connection().execute(
+            "SELECT body FROM state WHERE session_id = ? AND key = ?", (session_id, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_session(self, session_id):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def expire_sessions(self):
+        """Delete sessions not written to for ttl_seconds; returns how many"""
+        now = self._clock()
+        with self._expire_lock:
+            self._last_expire = now
+        cursor = self._connection().execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl_seconds,))
+        return cursor.rowcount
+
+
+class SessionHandle:
+    """One browser session's view of a session store
+
+    Writes go through as they happen: one row per new message, one per
+    image added or removed, and state values only when they change. A new
+    session is only created in the store by its first write, so visits that
+    never send anything leave no rows behind. The first write also recreates
+    (or refreshes) a resumed session's row, in case it expired after it was
+    looked up.
+    """
+
+    def __init__(self, store, session_id, exists=False):
+        self.store = store
+        self.session_id = session_id
+        self._saved_state = {}
+        self._exists = exists
+        self._ensured = False
+
+    def _ensure_session(self):
+        if not self._ensured:
+            self.store.create_session(self.session_id)
+            self._exists = self._ensured = True
+
+    def append_message(self, message):
+        self._ensure_session()
+        return self.store.append_message(self.session_id, message)
+
+    def clear_messages(self):
+        if self._exists:
+            self.store.clear_messages(self.session_id)
+
+    def load_messages(self, before_seq=None, limit=DEFAULT_RESUME_MESSAGES):
+        """Return (messages, first_seq) for the last ``limit`` messages before ``before_seq``
+
+        first_seq is the seq of the oldest returned message; None when there are none.
+        """
+        rows = self.store.load_messages(self.session_id, before_seq=before_seq, limit=limit)
+        return [message for _, message in rows], (rows[0][0] if rows else None)
+
+    def image_changed(self, event, record):
+        """ImageStore change listener: persist added and removed records"""
+        if event == "add":
+            self._ensure_session()
+            self.store.put_image(self.session_id, record)
+        elif event == "remove" and self._exists:
+            self.store.remove_image(self.session_id, record["hash"])
+
+    def load_images(self):
+        return self.store.load_images(self.session_id)
+
+    def save_state(self, key, value):
+        """Persist a JSON-serializable value if it changed since the last save"""
+        encoded = json.dumps(value, sort_keys=True, default=str)
+        if self._saved_state.get(key) == encoded:
+            return
+        self._ensure_session()
+        self.store.save_state(self.session_id, key, value)
+        self._saved_state[key] = encoded
+
+    def load_state(self, key, default=None):
+        """Return a stored value, or ``default``, which then counts as already saved"""
+        value = self.store.load_state(self.session_id, key) if self._exists else None
+        if value is None:
+            value = default
+        self._saved_state[key] = json.dumps(value, sort_keys=True, default=str)
+        return value
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Return the process-wide session store, or None when SESSION_STORE=none"""
+    global _store
+    with _store_lock:
+        if _store is None and BACKEND != "none":
+            _store = MemorySessionStore() if BACKEND == "memory" else SQLiteSessionStore()
+        return _store
@@ -0,0 +1,128 @@
+import io
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+
+# Preview sizes (longest edge, in pixels) used by the UI
+GALLERY_SIZE = 300
+CHAT_SIZE = 150
+GENERATED_SIZE = 300
+
+# Upper bound on the memory held by cached previews
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+THUMBNAIL_FORMAT = "JPEG"
+THUMBNAIL_QUALITY = 80
+
+
+def make_thumbnail(data, max_size, quality=THUMBNAIL_QUALITY):
+    """Decode an image once and return a downscaled, compressed preview
+
+    Args:
+        data (bytes): Full-resolution image bytes
+        max_size (int): Longest edge of the preview in pixels
+        quality (int): JPEG quality of the preview
+
+    Returns:
+        bytes: Encoded JPEG preview
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # draft() lets the JPEG decoder skip full-resolution decoding
+        image.draft("RGB", (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        out = io.BytesIO()
+        image.save(out, format=THUMBNAIL_FORMAT, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+_missing = {}
+
+
+def missing_thumbnail(max_size):
+    """Return a plain grey preview shown in place of an image whose bytes are gone"""
+    thumb = _missing.get(max_size)
+    if thumb is None:
+        out = io.BytesIO()
+        Image.new("RGB", (max_size, max_size), (200, 200, 200)).save(out, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        thumb = _missing[max_size] = out.getvalue()
+    return thumb
+
+
+class ThumbnailCache:
+    """Thread-safe LRU cache of encoded previews keyed by (content hash, size)
+
+    Eviction is bounded by the total size of the cached previews.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, image_hash, max_size, load_data):
+        """Return the preview for an image, building it on a miss
+
+        Args:
+            image_hash (str): Content hash of the full-resolution image
+            max_size (int): Longest edge of the preview in pixels
+            load_data (callable): Returns the full-resolution bytes; only called on a miss
+
+        Returns:
+            bytes: Encoded preview
+        """
+        key = (image_hash, max_size)
+        with self._lock:
+            thumb = self._entries.get(key)
+            if thumb is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return thumb
+            self.misses += 1
+
+        thumb = make_thumbnail(load_data(), max_size)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = thumb
+                self._bytes += len(thumb)
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self._bytes -= len(old)
+                    self.evictions += 1
+        return thumb
+
+    def stats(self):
+        """Return cache size and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Process-wide cache; previews are keyed by content hash so sessions can share them
+_cache = ThumbnailCache()
+
+
+def get_thumbnail(image_hash, max_size, load_data):
+    """Return a cached preview for an image from the process-wide cache"""
+    return _cache.get(image_hash, max_size, load_data)
+
+
+def cache_stats():
+    """Return inspection data for the process-wide thumbnail cache"""
+    return _cache.stats()
@@ -1,147 +1,513 @@
 import streamlit as st
-import io
-from PIL import Image
 import utils # Assuming utils.py is in the same directory
+import gemini_experimental
+import image_store as image_store_module
+import thumbnails
+import video_jobs
+import artifact_store
+import blob_store
+import metrics
+import ingest
+import media_server
+import variants
 import os # For os.path.basename if used within moved code, though not directly in sidebar snippet
+import uuid
 
+# Chat messages shown at first and added by each "Load older messages" click
+CHAT_PAGE_SIZE = int(os.environ.get("CHAT_PAGE_SIZE", "30"))
+
+@metrics.timed("ui_render", section="sidebar")
 def render_sidebar(st_session_state):
     """Renders the sidebar UI for image upload and management."""
     st.header("Upload & Manage Images")
     
+    _render_image_gallery(st_session_state)
+                
+    # Clear chat button; the chat tab changes too, so the whole app reruns
+    if st_session_state.messages:
+        if st.button("Clear Chat"):
+            st_session_state.messages = []
+            if st_session_state.get("session_handle") is not None:
+                st_session_state.session_handle.clear_messages()
+            st_session_state.image_store.clear(image_store_module.GENERATED)  # Also clear generated images
+            st_session_state.pop("chat_render_cache", None)
+            st_session_state.pop("chat_visible_count", None)
+            st_session_state.pop("history_start_seq", None)
+            st_session_state.pop("unloaded_history", None)
+            st_session_state.pop("pending_variants", None)
+            st.rerun()
+
+@st.fragment
+@metrics.timed("ui_render", section="gallery")
+def _render_image_gallery(st_session_state):
+    """Renders the uploader and gallery as a fragment.
+
+    Removing an image reruns only this fragment. New uploads rerun the whole
+    app so they also show up in the video tab's image picker.
+    """
     # Image uploader - with multiple file support
     uploaded_files = st.file_uploader("Upload images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     
+    image_store = st_session_state.image_store
+    # Uploads that could not be decoded, by raw-byte hash, so they aren't retried every run
+    failed_uploads = st_session_state.setdefault("failed_uploads", {})
     if uploaded_files:
-        # Process all uploaded images
-        for uploaded_file in uploaded_files:
-            # Check if image with same name already exists to prevent duplicates
-            if not utils.is_duplicate_image(uploaded_file.name, st_session_state.images):
-                img_data = utils.process_uploaded_image(uploaded_file)
-                st_session_state.images.append(img_data)
+        uploaded_names = {uploaded_file.name for uploaded_file in uploaded_files}
+        for name, error in failed_uploads.values():
+            if name in uploaded_names:
+                st.warning(f"Could not read {name}: {error}")
+        
+        # Already-ingested files are skipped by name or content hash before any decoding
+        pending = ingest.pending_uploads(uploaded_files, image_store, skip_hashes=failed_uploads)
+        if pending:
+            progress = st.progress(0.0, text=f"Processing {len(pending)} images...")
+            preview_cols = st.columns(2)
+            added = 0
+            for done, result in enumerate(ingest.ingest(pending, blobs=image_store.blobs), 1):
+                if result.error:
+                    failed_uploads[result.hash] = (result.name, result.error)
+                    st.warning(f"Could not read {result.name}: {result.error}")
+                else:
+                    image_store.add_record(result.record, kind=image_store_module.UPLOADED)
+                    added += 1
+                    # Show each image as soon as its own processing is done
+                    with preview_cols[(added - 1) % 2]:
+                        st.image(result.thumbnail, caption=result.name, use_container_width=True)
+                progress.progress(done / len(pending), text=f"Processed {done} of {len(pending)} images")
+            if added:
+                st.rerun()
     
     # Display and manage uploaded images
-    if st_session_state.images:
-        st.subheader(f"Your Images ({len(st_session_state.images)})")
+    uploaded_images = image_store.uploaded()
+    if uploaded_images:
+        st.subheader(f"Your Images ({len(uploaded_images)})")
         
         # Create columns for the gallery
         cols = st.columns(2)
         
-        for i, img_data in enumerate(st_session_state.images):
+        for i, img_data in enumerate(uploaded_images):
             col_idx = i % 2
             with cols[col_idx]:
-                # Load image from bytes
-                img = Image.open(io.BytesIO(img_data["data"]))
-                
-                # Display image with caption
-                st.image(img, caption=f"{i+1}. {img_data['name']}", use_container_width=True, width=300)
+                # Display a cached preview instead of decoding the full image
+                thumb = _thumbnail(img_data["hash"], thumbnails.GALLERY_SIZE, lambda: image_store.get_data(img_data["hash"]))
+                st.image(thumb, caption=f"{i+1}. {img_data['name']}", use_container_width=True, width=300)
                 
                 # Remove button
-                if st.button("Remove", key=f"remove_sidebar_{i}"): # Added _sidebar_ to key for uniqueness
-                    st_session_state.images.pop(i)
-                    st.rerun()
-                
-    # Clear chat button
-    if st_session_state.messages:
-        if st.button("Clear Chat"):
-            st_session_state.messages = []
-            st_session_state.generated_images = []  # Also clear generated images
-            st.rerun()
+                if st.button("Remove", key=f"remove_sidebar_{img_data['hash']}"): # Added _sidebar_ to key for uniqueness
+                    image_store.remove(img_data["hash"])
+                    st.rerun(scope="fragment")
+
+def _thumbnail(image_hash, max_size, load_data):
+    """Return a cached preview, or a grey placeholder when the image's bytes are gone."""
+    try:
+        return thumbnails.get_thumbnail(image_hash, max_size, load_data)
+    except FileNotFoundError:
+        return thumbnails.missing_thumbnail(max_size)
+
+def new_message(role, content, **fields):
+    """Return a chat message with a stable id, used for render caching and widget keys."""
+    message = {"id": uuid.uuid4().hex, "role": role, "content": content}
+    message.update(fields)
+    return message
+
+def _append_message(st_session_state, message):
+    """Add a message to the chat and, when sessions are persisted, append it to the store."""
+    st_session_state.messages.append(message)
+    if st_session_state.get("session_handle") is not None:
+        st_session_state.session_handle.append_message(message)
+
+def _save_session_value(st_session_state, key):
+    """Persist a session state value (only written when it changed)."""
+    if st_session_state.get("session_handle") is not None:
+        st_session_state.session_handle.save_state(key, st_session_state[key])
+
+def _message_view(message, image_store):
+    """Prepare the thumbnails a message shows; the result is cached per message id."""
+    view = {"images": {}, "thumb": None}
+    for img_hash in message.get("images") or []:
+        if img_hash in image_store:
+            view["images"][img_hash] = _thumbnail(img_hash, thumbnails.CHAT_SIZE, lambda: image_store.get_data(img_hash))
+    if not isinstance(message["content"], str):
+        try:
+            view["thumb"] = thumbnails.get_thumbnail(message["content"]["hash"], thumbnails.GENERATED_SIZE, lambda: blob_store.read(message["content"]))
+        except FileNotFoundError:
+            # A persisted message whose blob is gone (e.g. evicted)
+            view["thumb"] = None
+    return view
+
+def _render_message(message, view, image_store, save_binary_file_func):
+    """Render one chat message from its cached view."""
+    with st.chat_message(message["role"]):
+        if message.get("images"):
+            image_cols = st.columns(min(len(message["images"]), 4))
+            for idx, img_hash in enumerate(message["images"]):
+                with image_cols[idx % min(len(message["images"]), 4)]:
+                    img_data = image_store.get(img_hash)
+                    if img_data is None:
+                        st.caption("(image removed)")
+                        continue
+                    thumb = view["images"].get(img_hash)
+                    if thumb is None:
+                        # Re-uploaded after the view was built
+                        thumb = view["images"][img_hash] = _thumbnail(img_hash, thumbnails.CHAT_SIZE, lambda: image_store.get_data(img_hash))
+                    st.image(thumb, caption=f"{img_data['name']}", width=150)
+            st.caption(f"Message included {len(message['images'])} images")
+        
+        if isinstance(message["content"], str):
+            st.markdown(message["content"])
+        else:
+            # Image messages hold a blob reference; bytes are read only when needed
+            if view["thumb"] is None:
+                st.caption("(image removed)")
+                return
+            st.image(view["thumb"], caption="Generated Image", width=300)
+            # Full-resolution file is only written and sent to the browser on request
+            if st.checkbox("Show full size", key=f"full_size_{message['id']}"):
+                if not message.get("file_path") or not os.path.isfile(message["file_path"]):
+                    # Never saved, or evicted from the artifact store: write it out again
+                    try:
+                        image_bytes = blob_store.read(message["content"])
+                    except FileNotFoundError:
+                        st.caption("(full-size image removed)")
+                        return
+                    message["file_path"] = save_binary_file_func(image_bytes, message["mime_type"])
+                artifact_store.touch_file(message["file_path"])
+                # A URL when the media server is on, so the browser fetches and caches the file itself
+                st.image(media_server.media_source(message["file_path"]), use_container_width=True)
+
+def _render_history(st_session_state, save_binary_file_func):
+    """Render the most recent messages, with paging to older ones.
+
+    Only the last ``chat_visible_count`` messages are rendered, and each one
+    from a view cached by message id, so a rerun costs the same however long
+    the conversation is. A resumed session holds only its recent messages;
+    older ones are read from the session store a page at a time, starting
+    before ``history_start_seq``.
+    """
+    messages = st_session_state.messages
+    image_store = st_session_state.image_store
+    visible = st_session_state.get("chat_visible_count", CHAT_PAGE_SIZE)
+    start = max(0, len(messages) - visible)
+    # Seq of the oldest loaded message; anything before it is still in the store
+    start_seq = st_session_state.get("history_start_seq")
+    has_stored_older = start_seq is not None and start_seq > 1
+    if start or has_stored_older:
+        if start:
+            st.caption(f"Showing the last {len(messages) - start} of {len(messages)} loaded messages")
+        if st.button("Load older messages", key="chat_load_older"):
+            if not start and has_stored_older:
+                older, first_seq = st_session_state.session_handle.load_messages(before_seq=start_seq, limit=CHAT_PAGE_SIZE)
+                messages[:0] = older
+                st_session_state.history_start_seq = first_seq if older else None
+            st_session_state.chat_visible_count = visible + CHAT_PAGE_SIZE
+            st.rerun(scope="fragment")
+    
+    cache = st_session_state.setdefault("chat_render_cache", {})
+    shown = set()
+    for message in messages[start:]:
+        if "id" not in message:
+            message["id"] = uuid.uuid4().hex
+        view = cache.get(message["id"])
+        if view is None:
+            view = cache[message["id"]] = _message_view(message, image_store)
+        shown.add(message["id"])
+        _render_message(message, view, image_store, save_binary_file_func)
+    
+    # Drop views of messages that are no longer shown
+    for message_id in [key for key in cache if key not in shown]:
+        del cache[message_id]
+
+def _add_assistant_reply(st_session_state, response_text, response_image, response_mime_type, save_binary_file_func):
+    """Add a reply's text and image to the chat, and the image to the generated images."""
+    if response_text:
+        _append_message(st_session_state, new_message("assistant", response_text))
+    
+    if response_image:
+        file_name = save_binary_file_func(response_image, response_mime_type)
+        # The image store writes the bytes to the blob store once; the message
+        # keeps only a reference to that record's blob
+        image_store = st_session_state.image_store
+        record, _ = image_store.add(
+            response_image,
+            os.path.basename(file_name),
+            kind=image_store_module.GENERATED,
+            mime_type=response_mime_type,
+            file_path=file_name
+        )
+        _append_message(st_session_state, new_message(
+            "assistant",
+            image_store.blob_ref(record["hash"]),
+            mime_type=response_mime_type,
+            file_path=file_name
+        ))
+
+def _render_variant(variant):
+    """Render one variant's image and text in the current container."""
+    if variant.error:
+        st.error(f"Variant {variant.index + 1} failed: {variant.error}")
+        return
+    if variant.image is not None:
+        st.image(
+            _thumbnail(variant.image["hash"], thumbnails.GENERATED_SIZE, lambda: blob_store.read(variant.image)),
+            caption=f"Variant {variant.index + 1}",
+            use_container_width=True
+        )
+    if variant.text:
+        st.markdown(variant.text)
 
-def render_chat_tab(st_session_state, gemini_api_key_param, save_binary_file_func, generate_response_func, chat_container, input_container):
-    """Renders the 'Image Chat' tab UI and handles its logic."""
+def _generate_variants(generate, count, owner):
+    """Run variants in parallel, filling a grid as each one finishes.
+    
+    Returns:
+        list: Variant tuples in index order
+    """
+    cols = st.columns(min(count, 4))
+    slots = [cols[index % len(cols)].empty() for index in range(count)]
+    for slot in slots:
+        slot.markdown("_Generating..._")
+    results = []
+    for variant in variants.get_variant_runner().run(owner, count, generate):
+        with slots[variant.index].container():
+            _render_variant(variant)
+        results.append(variant)
+    # Fewer may have run than asked for if the session reached its cap meanwhile
+    for slot in slots[len(results):]:
+        slot.empty()
+    return sorted(results, key=lambda variant: variant.index)
+
+def _render_pending_variants(st_session_state, save_binary_file_func):
+    """Show generated variants until the user keeps one or discards them all.
+    
+    Only the chosen variant is added to the chat and the generated images.
+    """
+    pending = st_session_state.get("pending_variants")
+    if not pending:
+        return
+    with st.chat_message("assistant"):
+        st.caption("Pick a variant to continue the conversation with")
+        cols = st.columns(min(len(pending["variants"]), 4))
+        for variant in pending["variants"]:
+            with cols[variant.index % len(cols)]:
+                _render_variant(variant)
+                if variant.error is None and st.button("Use this", key=f"variant_pick_{pending['id']}_{variant.index}"):
+                    try:
+                        image = blob_store.read(variant.image) if variant.image is not None else None
+                    except FileNotFoundError:
+                        st.warning("This variant's image is no longer available. Pick another or send the prompt again.")
+                        continue
+                    _add_assistant_reply(st_session_state, variant.text, image, variant.mime_type, save_binary_file_func)
+                    st_session_state.pop("pending_variants", None)
+                    # A kept image feeds the video tab
+                    if image is not None:
+                        st.rerun()
+                    st.rerun(scope="fragment")
+        if st.button("Discard variants", key=f"variant_discard_{pending['id']}"):
+            st_session_state.pop("pending_variants", None)
+            st.rerun(scope="fragment")
+
+def _stream_assistant_reply(events):
+    """Render streamed Gemini events incrementally inside the current chat message.
+
+    Returns:
+        tuple: (response_text, response_image, response_mime_type)
+    """
+    text_placeholder = st.empty()
+    text_placeholder.markdown("_Gemini is thinking..._")
+    response_text = ""
+    response_image = None
+    response_mime_type = None
+
+    for event in events:
+        if isinstance(event, gemini_experimental.TextDelta):
+            response_text += event.text
+            text_placeholder.markdown(response_text + "▌")
+        elif isinstance(event, gemini_experimental.ImagePart):
+            response_image = event.data
+            response_mime_type = event.mime_type
+            image_hash = image_store_module.content_hash(response_image)
+            st.image(
+                thumbnails.get_thumbnail(image_hash, thumbnails.GENERATED_SIZE, lambda: response_image),
+                caption="Generated Image",
+                width=300
+            )
+
+    if response_text:
+        text_placeholder.markdown(response_text)
+    else:
+        text_placeholder.empty()
+    return response_text, response_image, response_mime_type
+
+@st.fragment
+@metrics.timed("ui_render", section="chat")
+def render_chat_tab(st_session_state, gemini_api_key_param, save_binary_file_func, generate_response_func, chat_container=None, input_container=None, stream_response_func=None, response_cache_enabled=False, variant_generator_func=None):
+    """Renders the 'Image Chat' tab UI and handles its logic.
+
+    The tab is a fragment: a text-only turn reruns just the chat. A turn
+    that generates an image, or the first turn (which adds "Clear Chat" to
+    the sidebar), reruns the whole app. Containers are created inside the
+    fragment when not given; passed-in containers must be created inside it
+    too.
+
+    When ``stream_response_func`` is given, the assistant reply is rendered
+    token by token as Gemini streams it; otherwise ``generate_response_func``
+    is called and the full reply is shown once it completes.
+
+    With ``response_cache_enabled``, a "Fresh sample" toggle lets the user
+    skip cached answers (stored as ``bypass_response_cache`` in session state).
+    
+    With ``variant_generator_func``, the user can ask for several variants
+    of a reply. ``variant_generator_func(prompt)`` must return a function
+    that generates one variant from a worker thread. The variants are
+    requested in parallel and shown in a grid as they finish, and only the
+    one the user picks is added to the chat.
+    """
+    chat_container = chat_container or st.container()
+    input_container = input_container or st.container()
+    
     # Display chat messages in the chat container first
     with chat_container:
         st.markdown("Upload images and chat about them. Gemini can generate images in response.")
-        for message in st_session_state.messages:
-            with st.chat_message(message["role"]):
-                if "images" in message and message["images"]:
-                    image_cols = st.columns(min(len(message["images"]), 4))
-                    for idx, img_idx in enumerate(message["images"]):
-                        with image_cols[idx % min(len(message["images"]), 4)]:
-                            img_data = st_session_state.images[img_idx]
-                            img = Image.open(io.BytesIO(img_data["data"]))
-                            st.image(img, caption=f"{img_data['name']}", width=150)
-                    st.caption(f"Message included {len(message['images'])} images")
-                
-                if isinstance(message["content"], str):
-                    st.markdown(message["content"])
-                else:
-                    if "file_path" not in message:
-                        message["file_path"] = save_binary_file_func(message["content"], message["mime_type"])
-                    st.image(message["file_path"], caption="Generated Image", width=300)
-                    
-                    if message["role"] == "assistant" and not isinstance(message["content"], str):
-                        if not utils.is_duplicate_generated_image(message["content"], st_session_state.generated_images):
-                            st_session_state.generated_images.append({
-                                "name": os.path.basename(message["file_path"]),
-                                "data": message["content"],
-                                "mime_type": message["mime_type"],
-                                "file_path": message["file_path"]
-                            })
+        _render_history(st_session_state, save_binary_file_func)
+        _render_pending_variants(st_session_state, save_binary_file_func)
     
     with input_container:
+        if response_cache_enabled:
+            st.toggle(
+                "Fresh sample",
+                key="bypass_response_cache",
+                help="Skip cached answers and ask Gemini for a new response."
+            )
+        variant_count = 1
+        runner = variants.get_variant_runner()
+        if variant_generator_func is not None and runner.max_per_owner > 1:
+            variant_count = st.number_input(
+                "Variants",
+                min_value=1,
+                max_value=runner.max_per_owner,
+                value=1,
+                key="variant_count",
+                help="Generate several replies in parallel and keep the one you like."
+            )
         if prompt := st.chat_input("Message Gemini..."):
-            image_indices = list(range(len(st_session_state.images)))
-            st_session_state.messages.append({
-                "role": "user", 
-                "content": prompt,
-                "images": image_indices if image_indices else None
-            })
+            # Unpicked variants are dropped once the conversation moves on
+            st_session_state.pop("pending_variants", None)
+            if variant_count > 1:
+                variant_count = min(variant_count, runner.available(st_session_state.session_id))
+                if variant_count < 1:
+                    st.warning("Variants from an earlier message are still being generated. Try again shortly.")
+                    return
+            first_turn = not st_session_state.messages
+            image_store = st_session_state.image_store
+            # Uploads whose bytes are gone can't be sent; drop them with a notice
+            missing = image_store.missing(image_store.uploaded())
+            for record in missing:
+                image_store.remove(record["hash"])
+                st.toast(f"{record['name']} is no longer available and was not sent. Upload it again to include it.")
+            image_hashes = [img["hash"] for img in image_store.uploaded()]
+            _append_message(st_session_state, new_message(
+                "user",
+                prompt,
+                images=image_hashes if image_hashes else None
+            ))
             
-            with st.spinner("Gemini is thinking..."):
-                response_text, response_image, response_mime_type = generate_response_func(prompt)
-                
-                if response_text:
-                    st_session_state.messages.append({"role": "assistant", "content": response_text})
-                
-                if response_image:
-                    file_name = save_binary_file_func(response_image, response_mime_type)
-                    st_session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response_image,
-                        "mime_type": response_mime_type,
-                        "file_path": file_name
-                    })
-                    if not utils.is_duplicate_generated_image(response_image, st_session_state.generated_images):
-                        st_session_state.generated_images.append({
-                            "name": os.path.basename(file_name),
-                            "data": response_image,
-                            "mime_type": response_mime_type,
-                            "file_path": file_name
-                        })
-            st.rerun() # Rerun to display new messages and potentially clear input
-
-def render_video_generation_tab(st_session_state, video_gen_module, temp_dir):
-    """Renders the 'Video Generation' tab UI and handles its logic."""
-    st.header("Video Generation")
+            if variant_count > 1:
+                with chat_container:
+                    with st.chat_message("user"):
+                        st.markdown(prompt)
+                    with st.chat_message("assistant"):
+                        results = _generate_variants(
+                            variant_generator_func(prompt), variant_count, st_session_state.session_id
+                        )
+                st_session_state.pending_variants = {"id": uuid.uuid4().hex, "variants": results}
+                if first_turn or missing:
+                    st.rerun()
+                st.rerun(scope="fragment")
+            elif stream_response_func is not None:
+                # Show the new turn right away and stream the reply into it
+                with chat_container:
+                    with st.chat_message("user"):
+                        st.markdown(prompt)
+                    with st.chat_message("assistant"):
+                        response_text, response_image, response_mime_type = _stream_assistant_reply(
+                            stream_response_func(prompt)
+                        )
+            else:
+                with st.spinner("Gemini is thinking..."):
+                    response_text, response_image, response_mime_type = generate_response_func(prompt)
 
-    # Ensure session state for video generation is initialized robustly
-    default_video_state = {
-        "prompt": "",
-        "selected_image_name": None,
-        "video_path": None,
-        "error_message": None,
-        "generating": False
-    }
-    if "video_generation_state" not in st_session_state:
-        st_session_state.video_generation_state = default_video_state.copy()
-    else:
-        for key, value in default_video_state.items():
-            if key not in st_session_state.video_generation_state:
-                st_session_state.video_generation_state[key] = value
+            _add_assistant_reply(st_session_state, response_text, response_image, response_mime_type, save_binary_file_func)
+            if response_image or first_turn or missing:
+                # Generated images feed the video tab; the first turn adds "Clear Chat";
+                # dropped uploads leave the gallery
+                st.rerun()
+            st.rerun(scope="fragment") # Rerun to display new messages and clear input
 
-    # Robust initialization for text-to-video specific states
-    if "text_video_prompt" not in st_session_state:
-        st_session_state.text_video_prompt = ""
-    if "text_video_path" not in st_session_state:
-        st_session_state.text_video_path = None
-    if "text_video_error" not in st_session_state:
-        st_session_state.text_video_error = None
-    if "text_video_generating" not in st_session_state:
-        st_session_state.text_video_generating = False
+# Seconds between refreshes of the video job list while jobs are active
+JOB_POLL_INTERVAL = 2
 
-    # --- Helper function to INITIATE Image-to-Video --- 
-    def _initiate_image_to_video_generation():
+_JOB_KIND_LABELS = {
+    "image_to_video": "Image-to-Video",
+    "text_to_video": "Text-to-Video",
+}
+
+def _render_video_jobs(st_session_state, job_manager):
+    """Renders this session's video jobs, polling while any are still active."""
+    jobs = job_manager.list_jobs(owner=st_session_state.session_id)
+    polling = any(job["status"] in video_jobs.ACTIVE_STATUSES for job in jobs)
+
+    @st.fragment(run_every=JOB_POLL_INTERVAL if polling else None)
+    def jobs_panel():
+        current_jobs = job_manager.list_jobs(owner=st_session_state.session_id)
+        if polling and not any(job["status"] in video_jobs.ACTIVE_STATUSES for job in current_jobs):
+            # Everything finished: do one full rerun so polling stops
+            st.rerun()
+
+        if not current_jobs:
+            st.caption("No video jobs yet. Queued videos will appear here.")
+            return
+
+        for job in reversed(current_jobs):
+            with st.container(border=True):
+                st.markdown(f"**{_JOB_KIND_LABELS.get(job['kind'], job['kind'])}** — {job['label']}")
+
+                if job["status"] in video_jobs.ACTIVE_STATUSES:
+                    st.progress(job["progress"] or 0.0, text=f"{job['status'].capitalize()}: {job['message']}")
+                    if st.button("Cancel", key=f"cancel_job_{job['id']}"):
+                        job_manager.cancel(job["id"])
+                        st.rerun(scope="fragment")
+                    continue
+
+                if job["status"] == video_jobs.SUCCEEDED:
+                    vid_col1, vid_col2, vid_col3 = st.columns([1, 1.5, 1]) # Adjust ratios as needed for desired width
+                    with vid_col2:
+                        if os.path.isfile(job["result"]):
+                            artifact_store.touch_file(job["result"])
+                            st.video(media_server.media_source(job["result"]))
+                        else:
+                            st.caption("This video has expired from storage.")
+                elif job["status"] == video_jobs.FAILED:
+                    st.error(f"Error generating video: {job['error']}")
+                else:
+                    st.caption("Cancelled")
+
+                if st.button("Clear", key=f"clear_job_{job['id']}"):
+                    job_manager.remove(job["id"])
+                    st.rerun(scope="fragment")
+
+    jobs_panel()
+
+@st.fragment
+@metrics.timed("ui_render", section="image_to_video")
+def _render_image_to_video_section(st_session_state, video_gen_module, temp_dir, job_manager):
+    """Renders the image-to-video form as a fragment.
+
+    Typing and selecting rerun only this form. Queuing a job reruns the whole
+    app so the job list starts polling. The image picker refreshes its
+    options whenever the fragment runs; a stale choice is caught when
+    queuing.
+    """
+    # --- Helper function to QUEUE Image-to-Video ---
+    def _queue_image_to_video_generation():
         selected_image_name = st_session_state.video_generation_state["selected_image_name"]
         prompt = st_session_state.video_generation_state["prompt"]
         
@@ -149,39 +515,42 @@ def render_video_generation_tab(st_session_state, video_gen_module, temp_dir):
 
         if not selected_image_name:
             st_session_state.video_generation_state["error_message"] = "Please select an image first."
-            st_session_state.video_generation_state["generating"] = False
-            st.rerun()
-            return
+            return False
         if not prompt:
             st_session_state.video_generation_state["error_message"] = "Please enter a prompt."
-            st_session_state.video_generation_state["generating"] = False
-            st.rerun()
-            return
-
-        st_session_state.video_generation_state["generating"] = True
-        st_session_state.video_generation_state["video_path"] = None # Clear previous video path
-        st.rerun() # This rerun will allow the main generation block to execute
-
-    # --- Helper function to INITIATE Text-to-Video ---
-    def _initiate_text_to_video_generation():
-        prompt = st_session_state.text_video_prompt
-        
-        st_session_state.text_video_error = None # Clear previous errors
+            return False
 
-        if not prompt:
-            st_session_state.text_video_error = "Please enter a prompt for text-to-video generation."
-            st_session_state.text_video_generating = False
-            st.rerun()
-            return
+        image_data_obj = utils.get_image_data_by_name(selected_image_name, st_session_state.image_store)
+        if not image_data_obj:
+            st_session_state.video_generation_state["error_message"] = f"Image '{selected_image_name}' not found."
+            return False
 
-        st_session_state.text_video_generating = True
-        st_session_state.text_video_path = None # Clear previous video path
-        st.rerun() # This rerun will allow the main generation block to execute
+        try:
+            model_bytes, model_mime_type = utils.get_model_image(image_data_obj)
+            job_manager.submit(
+                st_session_state.session_id,
+                "image_to_video",
+                video_gen_module.generate_video,
+                label=f"{selected_image_name}: {prompt}",
+                image_data=model_bytes,
+                prompt=prompt,
+                temp_dir=temp_dir,
+                mime_type=model_mime_type
+            )
+        except FileNotFoundError:
+            # Its bytes were evicted from the blob store
+            st_session_state.video_generation_state["error_message"] = (
+                f"Image '{selected_image_name}' is no longer available. Upload it again."
+            )
+            return False
+        except Exception as e:
+            st_session_state.video_generation_state["error_message"] = str(e)
+            return False
+        return True
 
     # --- Image-to-Video Section UI --- (Input fields and Generate Button)
     st.subheader("Image-to-Video Generation")
-    available_images = st_session_state.images + st_session_state.generated_images
-    image_names = [img["name"] for img in available_images]
+    image_names = st_session_state.image_store.names()
 
     if not image_names:
         st.info("Upload an image or generate one in the 'Image Chat' tab to use this feature.")
@@ -201,50 +570,41 @@ def render_video_generation_tab(st_session_state, video_gen_module, temp_dir):
             value=st_session_state.video_generation_state["prompt"],
             key="i2v_prompt"
         )
+        _save_session_value(st_session_state, "video_generation_state")
         if st.button("Generate Video from Image", key="i2v_generate_button"):
-            _initiate_image_to_video_generation()
-
-    # --- Actual Image-to-Video Generation Logic & Spinner ---
-    if st_session_state.video_generation_state["generating"] and \
-       not st_session_state.video_generation_state["video_path"] and \
-       not st_session_state.video_generation_state["error_message"]:
-        with st.spinner("Generating video from image... This may take a minute or two."):
-            try:
-                selected_image_name = st_session_state.video_generation_state["selected_image_name"]
-                prompt = st_session_state.video_generation_state["prompt"]
-                all_images_for_gen = st_session_state.images + st_session_state.generated_images
-                image_data_obj = utils.get_image_data_by_name(selected_image_name, all_images_for_gen)
-
-                if not image_data_obj: # Should be caught by selectbox logic, but defensive
-                    raise ValueError(f"Image '{selected_image_name}' not found during generation process.")
-                if not prompt: # Should be caught by initiator, but defensive
-                     raise ValueError("Prompt became empty during generation process.")
-
-                video_path = video_gen_module.generate_video(image_data_obj['data'], prompt, temp_dir)
-                st_session_state.video_generation_state["video_path"] = video_path
-            except Exception as e:
-                st_session_state.video_generation_state["error_message"] = f"Error generating video: {str(e)}"
-            finally:
-                st_session_state.video_generation_state["generating"] = False
-                st.rerun() # Rerun to update UI (remove spinner, show video/error)
-    
-    # Display Image-to-Video results (error or video) and clear button
+            if _queue_image_to_video_generation():
+                st.rerun()
+
     if st_session_state.video_generation_state["error_message"]:
         st.error(st_session_state.video_generation_state["error_message"])
-    
-    if st_session_state.video_generation_state["video_path"]:
-        vid_col1, vid_col2, vid_col3 = st.columns([1, 1.5, 1]) # Adjust ratios as needed for desired width
-        with vid_col2:
-            st.video(st_session_state.video_generation_state["video_path"])
-        if st.button("Clear Image-to-Video Output", key="i2v_clear_button"):
-            st_session_state.video_generation_state["video_path"] = None
-            st_session_state.video_generation_state["error_message"] = None
-            # Optionally reset prompt and selection, or keep them for quick retry
-            # st_session_state.video_generation_state["prompt"] = ""
-            # st_session_state.video_generation_state["selected_image_name"] = None 
-            st.rerun()
 
-    st.divider()
+@st.fragment
+@metrics.timed("ui_render", section="text_to_video")
+def _render_text_to_video_section(st_session_state, video_gen_module, temp_dir, job_manager):
+    """Renders the text-to-video form as a fragment (see _render_image_to_video_section)."""
+    # --- Helper function to QUEUE Text-to-Video ---
+    def _queue_text_to_video_generation():
+        prompt = st_session_state.text_video_prompt
+        
+        st_session_state.text_video_error = None # Clear previous errors
+
+        if not prompt:
+            st_session_state.text_video_error = "Please enter a prompt for text-to-video generation."
+            return False
+
+        try:
+            job_manager.submit(
+                st_session_state.session_id,
+                "text_to_video",
+                video_gen_module.generate_video_from_text,
+                label=prompt,
+                prompt=prompt,
+                temp_dir=temp_dir
+            )
+        except Exception as e:
+            st_session_state.text_video_error = str(e)
+            return False
+        return True
 
     # --- Text-to-Video Section UI --- (Input field and Generate Button)
     st.subheader("Text-to-Video Generation")
@@ -253,37 +613,48 @@ def render_video_generation_tab(st_session_state, video_gen_module, temp_dir):
         value=st_session_state.text_video_prompt,
         key="t2v_prompt"
     )
+    _save_session_value(st_session_state, "text_video_prompt")
     if st.button("Generate Video from Text", key="t2v_generate_button"):
-        _initiate_text_to_video_generation()
-
-    # --- Actual Text-to-Video Generation Logic & Spinner ---
-    if st_session_state.text_video_generating and \
-       not st_session_state.text_video_path and \
-       not st_session_state.text_video_error:
-        with st.spinner("Generating video from text... This may take a minute or two."):
-            try:
-                prompt = st_session_state.text_video_prompt
-                if not prompt: # Should be caught by initiator, but defensive
-                    raise ValueError("Text prompt became empty during generation process.")
-                video_path = video_gen_module.generate_video_from_text(prompt, temp_dir)
-                st_session_state.text_video_path = video_path
-            except Exception as e:
-                st_session_state.text_video_error = f"Error generating video from text: {str(e)}"
-            finally:
-                st_session_state.text_video_generating = False
-                st.rerun() # Rerun to update UI
-
-    # Display Text-to-Video results (error or video) and clear button
+        if _queue_text_to_video_generation():
+            st.rerun()
+
     if st_session_state.text_video_error:
         st.error(st_session_state.text_video_error)
 
-    if st_session_state.text_video_path:
-        vid_text_col1, vid_text_col2, vid_text_col3 = st.columns([1, 1.5, 1]) # Adjust ratios as needed
-        with vid_text_col2:
-            st.video(st_session_state.text_video_path)
-        if st.button("Clear Text-to-Video Output", key="t2v_clear_button"):
-            st_session_state.text_video_path = None
-            st_session_state.text_video_error = None
-            # Optionally reset prompt
-            # st_session_state.text_video_prompt = ""
-            st.rerun()
+@metrics.timed("ui_render", section="video")
+def render_video_generation_tab(st_session_state, video_gen_module, temp_dir, job_manager=None):
+    """Renders the 'Video Generation' tab UI and handles its logic.
+
+    Generations are queued on the process-wide job manager and run in the
+    background, so the tab stays responsive and several videos can be in
+    flight at once. The two forms and the job list are separate fragments.
+    """
+    st.header("Video Generation")
+    job_manager = job_manager or video_jobs.get_job_manager()
+
+    # Ensure session state for video generation is initialized robustly
+    default_video_state = video_gen_module.reset_video_state()
+    if "video_generation_state" not in st_session_state:
+        st_session_state.video_generation_state = default_video_state.copy()
+    else:
+        for key, value in default_video_state.items():
+            if key not in st_session_state.video_generation_state:
+                st_session_state.video_generation_state[key] = value
+
+    # Robust initialization for text-to-video specific states
+    if "text_video_prompt" not in st_session_state:
+        st_session_state.text_video_prompt = ""
+    if "text_video_error" not in st_session_state:
+        st_session_state.text_video_error = None
+
+    _render_image_to_video_section(st_session_state, video_gen_module, temp_dir, job_manager)
+
+    st.divider()
+
+    _render_text_to_video_section(st_session_state, video_gen_module, temp_dir, job_manager)
+
+    st.divider()
+
+    # --- Video jobs: queued, running and finished ---
+    st.subheader("Your Videos")
+    _render_video_jobs(st_session_state, job_manager)
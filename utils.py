@@ -1,7 +1,16 @@
 import os
 import uuid
 import io
-from PIL import Image
+from PIL import Image, ImageOps
+from image_store import content_hash
+import blob_store
+import artifact_store
+import metrics
+
+# Preprocessing applied to images before they are sent to Gemini or Replicate
+MODEL_IMAGE_MAX_DIMENSION = int(os.environ.get("MODEL_IMAGE_MAX_DIMENSION", "1536"))
+MODEL_IMAGE_FORMAT = os.environ.get("MODEL_IMAGE_FORMAT", "JPEG")
+MODEL_IMAGE_QUALITY = int(os.environ.get("MODEL_IMAGE_QUALITY", "85"))
 
 def ensure_temp_dir(base_dir=None):
     """Create a temp directory if it doesn't exist
@@ -36,11 +45,136 @@ def save_binary_file(data, mime_type, temp_dir):
     file_name = f"generated_{uuid.uuid4()}.{extension}"
     file_path = os.path.join(temp_dir, file_name)
     
-    with open(file_path, "wb") as f:
-        f.write(data)
-    
+    with metrics.span("save_binary_file"):
+        with open(file_path, "wb") as f:
+            f.write(data)
+        
+        # Let the artifact store account for the file (quota/TTL eviction)
+        artifact_store.register_file(file_path)
+    metrics.inc("artifact_bytes_written_total", len(data))
     return file_path
 
+def prepare_model_image(data, max_dimension=None, image_format=None, quality=None):
+    """Produce a model-ready variant of an image
+    
+    The image is rotated according to its EXIF orientation, downscaled so its
+    longest edge is at most ``max_dimension`` and re-encoded in the target
+    format. If that doesn't make the payload smaller and nothing needed
+    changing, the original bytes are returned unchanged.
+    
+    Args:
+        data (bytes): Original image bytes
+        max_dimension (int, optional): Longest edge in pixels. Defaults to MODEL_IMAGE_MAX_DIMENSION
+        image_format (str, optional): "JPEG", "PNG" or "WEBP". Defaults to MODEL_IMAGE_FORMAT
+        quality (int, optional): Encoder quality for lossy formats. Defaults to MODEL_IMAGE_QUALITY
+        
+    Returns:
+        tuple: (image_bytes, mime_type)
+    """
+    max_dimension = max_dimension or MODEL_IMAGE_MAX_DIMENSION
+    image_format = (image_format or MODEL_IMAGE_FORMAT).upper()
+    quality = quality or MODEL_IMAGE_QUALITY
+    
+    with Image.open(io.BytesIO(data)) as original:
+        original_format = original.format
+        original_mime = Image.MIME.get(original_format, "image/jpeg")
+        # EXIF tag 0x0112 is the orientation; anything other than 1 needs rotating
+        rotated = original.getexif().get(0x0112, 1) != 1
+        image = ImageOps.exif_transpose(original)
+        resized = max(image.size) > max_dimension
+        if resized:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.split()[-1])
+        
+        out = io.BytesIO()
+        save_kwargs = {"optimize": True}
+        if image_format in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = quality
+        image.save(out, format=image_format, **save_kwargs)
+    
+    encoded = out.getvalue()
+    if not resized and not rotated and len(encoded) >= len(data):
+        return data, original_mime
+    return encoded, Image.MIME.get(image_format, "image/jpeg")
+
+def detect_mime_type(data, default="image/jpeg"):
+    """Return the MIME type of image bytes based on their actual format
+    
+    Args:
+        data (bytes): Binary image data
+        default (str, optional): Returned when the format can't be identified
+        
+    Returns:
+        str: MIME type such as "image/png"
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return Image.MIME.get(image.format, default)
+    except Exception:
+        return default
+
+def get_model_image(img_data):
+    """Return the model-ready bytes and MIME type for an image record
+    
+    The variant is produced once, stored in the blob store next to the
+    original and referenced from the record.
+    
+    Args:
+        img_data (dict): Image record with a "hash" (or, before it is stored, "data") key
+        
+    Returns:
+        tuple: (image_bytes, mime_type)
+    """
+    ref = img_data.get("model_blob")
+    if ref is not None:
+        try:
+            return blob_store.read(ref), ref["mime_type"]
+        except FileNotFoundError:
+            # The variant was evicted from the blob store; build it again
+            pass
+    data = img_data["data"] if "data" in img_data else blob_store.read(img_data["hash"])
+    model_bytes, model_mime_type = prepare_model_image(data)
+    # Only a reference to the variant stays on the record
+    img_data["model_blob"] = blob_store.put(model_bytes, model_mime_type)
+    return model_bytes, model_mime_type
+
+def process_image_bytes(name, img_bytes):
+    """Validate raw image bytes and build an image record
+    
+    The original bytes are kept as uploaded; a downscaled, EXIF-normalized
+    variant for model requests is produced alongside them. Safe to call from
+    worker threads.
+    
+    Args:
+        name (str): Display name of the image
+        img_bytes (bytes): Raw image file contents
+        
+    Returns:
+        dict: Dictionary with image data
+        
+    Raises:
+        PIL.UnidentifiedImageError: If the bytes are not a readable image
+    """
+    metrics.inc("upload_bytes_total", len(img_bytes))
+    
+    with metrics.span("image_preprocess"):
+        # Validate the upload and read its real format without a full decode
+        with Image.open(io.BytesIO(img_bytes)) as image:
+            image_format = image.format or "JPEG"
+        
+        img_data = {
+            "name": name,
+            "data": img_bytes,
+            "format": image_format,
+            "mime_type": Image.MIME.get(image_format, "image/jpeg")
+        }
+        get_model_image(img_data)
+    return img_data
+
 def process_uploaded_image(uploaded_file):
     """Process an uploaded image file
     
@@ -50,60 +184,40 @@ def process_uploaded_image(uploaded_file):
     Returns:
         dict: Dictionary with image data
     """
-    image = Image.open(uploaded_file)
-    
-    # Convert to bytes for Gemini API
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format=image.format or "JPEG")
-    img_bytes = img_byte_arr.getvalue()
-    
-    return {
-        "name": uploaded_file.name,
-        "data": img_bytes,
-        "format": image.format or "JPEG"
-    }
+    return process_image_bytes(uploaded_file.name, uploaded_file.getvalue())
 
-def is_duplicate_image(image_name, existing_images):
+def is_duplicate_image(image_name, image_store):
     """Check if an image with the same name already exists
     
     Args:
         image_name (str): Name of the image to check
-        existing_images (list): List of existing image dictionaries
+        image_store (ImageStore): Store holding the session's images
         
     Returns:
         bool: True if the image already exists, False otherwise
     """
-    for existing_img in existing_images:
-        if existing_img["name"] == image_name:
-            return True
-    return False
+    return image_store.get_by_name(image_name) is not None
 
-def is_duplicate_generated_image(image_data, generated_images):
-    """Check if an image with the same data already exists in generated images
+def is_duplicate_generated_image(image_data, image_store):
+    """Check if an image with the same data already exists in the store
     
     Args:
         image_data (bytes): Binary image data to check
-        generated_images (list): List of existing generated image dictionaries
+        image_store (ImageStore): Store holding the session's images
         
     Returns:
         bool: True if the image already exists, False otherwise
     """
-    for img in generated_images:
-        if img["data"] == image_data:
-            return True
-    return False
+    return content_hash(image_data) in image_store
 
-def get_image_data_by_name(image_name, image_list):
-    """Retrieve image data dictionary from a list by its name.
+def get_image_data_by_name(image_name, image_store):
+    """Retrieve an image record from the store by its name.
 
     Args:
         image_name (str): The name of the image to find.
-        image_list (list): A list of image dictionaries (e.g., from st.session_state.images).
+        image_store (ImageStore): Store holding the session's images.
 
     Returns:
         dict or None: The image dictionary if found, otherwise None.
     """
-    for img_data in image_list:
-        if img_data.get("name") == image_name:
-            return img_data
-    return None
+    return image_store.get_by_name(image_name)
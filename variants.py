@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import blob_store
+import metrics
+
+# Most variant requests one session may have in flight at once
+DEFAULT_MAX_VARIANTS = int(os.environ.get("GEMINI_MAX_VARIANTS", "4"))
+# Worker threads shared by every session; each request also passes the Gemini rate limiter
+DEFAULT_WORKERS = int(os.environ.get("VARIANT_WORKERS", "16"))
+
+# One generated variant: image is a blob reference (None for a text-only
+# reply) and error is set instead when the request failed
+Variant = namedtuple("Variant", ["index", "text", "image", "mime_type", "seconds", "error"])
+
+
+class VariantRunner:
+    """Runs several generations of the same turn in parallel
+
+    Each variant is a separate Gemini request on a shared thread pool, so N
+    variants take about as long as the slowest one instead of N requests in
+    a row. Requests still go through the Gemini rate limiter, and each owner
+    (browser session) may have at most ``max_per_owner`` in flight.
+
+    Generated images are put in the blob store as they arrive; nothing is
+    added to the conversation until the caller picks a variant.
+    """
+
+    def __init__(self, max_per_owner=DEFAULT_MAX_VARIANTS, workers=DEFAULT_WORKERS, executor=None):
+        self.max_per_owner = max_per_owner
+        self._executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="variant")
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.completed = 0
+        self.failed = 0
+
+    def available(self, owner):
+        """Return how many more variants the owner may start now"""
+        with self._lock:
+            return max(0, self.max_per_owner - self._in_flight.get(owner, 0))
+
+    def _reserve(self, owner, count):
+        with self._lock:
+            granted = max(0, min(count, self.max_per_owner - self._in_flight.get(owner, 0)))
+            if granted:
+                self._in_flight[owner] = self._in_flight.get(owner, 0) + granted
+            return granted
+
+    def _release(self, owner):
+        with self._lock:
+            remaining = self._in_flight.get(owner, 0) - 1
+            if remaining > 0:
+                self._in_flight[owner] = remaining
+            else:
+                self._in_flight.pop(owner, None)
+
+    def _run_one(self, owner, index, generate):
+        started = time.perf_counter()
+        try:
+            text, image, mime_type = generate(index)
+            image_ref = blob_store.put(image, mime_type) if image is not None else None
+            variant = Variant(index, text or "", image_ref, mime_type, time.perf_counter() - started, None)
+        except Exception as e:
+            variant = Variant(index, "", None, None, time.perf_counter() - started, str(e))
+        finally:
+            # Freed when the request ends, even if nobody consumes the result
+            self._release(owner)
+        with self._lock:
+            if variant.error:
+                self.failed += 1
+            else:
+                self.completed += 1
+        metrics.observe("variant_seconds", variant.seconds)
+        metrics.inc("variants_total", result="error" if variant.error else "ok")
+        return variant
+
+    def run(self, owner, count, generate):
+        """Start up to ``count`` variants and yield each one as it finishes
+
+        The count is capped by what the owner still has available; it may
+        be 0, in which case nothing is yielded.
+
+        Args:
+            owner (str): Session the variants belong to
+            count (int): Variants requested
+            generate (callable): Called as generate(index) on a worker thread;
+                returns (text, image_bytes, mime_type). It must not touch
+                Streamlit session state.
+
+        Yields:
+            Variant: In completion order
+        """
+        granted = self._reserve(owner, count)
+        started = time.perf_counter()
+        futures = []
+        try:
+            for index in range(granted):
+                futures.append(self._executor.submit(self._run_one, owner, index, generate))
+        except Exception:
+            # Slots for variants that never started
+            for _ in range(granted - len(futures)):
+                self._release(owner)
+            raise
+        for future in as_completed(futures):
+            yield future.result()
+        if futures:
+            metrics.observe("variant_batch_seconds", time.perf_counter() - started)
+
+    def stats(self):
+        """Return in-flight and completion counters"""
+        with self._lock:
+            return {
+                "in_flight": sum(self._in_flight.values()),
+                "owners": len(self._in_flight),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_variant_runner():
+    """Return the process-wide variant runner"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = VariantRunner()
+        return _runner
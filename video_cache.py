@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import artifact_store
+import metrics
+import video_jobs
+
+# Defaults for the process-wide cache; override via environment variables
+DEFAULT_MAX_BYTES = int(os.environ.get("VIDEO_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+NAMESPACE = "video_cache"
+
+# How often a waiting request checks its own cancellation
+WAIT_POLL_INTERVAL = 1
+
+
+def make_key(model, prompt, image_hash=None):
+    """Build the cache key for a video request
+
+    Args:
+        model (str): Replicate model identifier
+        prompt (str): Video prompt
+        image_hash (str, optional): Content hash of the input image
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    payload = json.dumps({"model": model, "prompt": prompt.strip(), "image": image_hash}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """An in-progress generation that identical requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.path = None
+        self.error = None
+        self.listeners = []
+
+    def report(self, progress=None, message=None):
+        for listener in list(self.listeners):
+            listener(progress, message)
+
+
+class VideoResultCache:
+    """Reuses finished videos and coalesces identical in-flight requests
+
+    Videos are stored in ``directory`` (the shared "video_cache" namespace of
+    the artifact store by default) as ``<key>.mp4``. Concurrent requests for
+    the same key wait on a single generation instead of each starting their
+    own. Total size is kept under ``max_bytes`` by evicting least recently
+    used videos.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, clock=time.time):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        for item in os.scandir(self.directory):
+            if item.is_file() and item.name.endswith(".mp4"):
+                stat = item.stat()
+                self._entries[item.name[:-4]] = {"size": stat.st_size, "last_access": stat.st_mtime}
+
+    def path_for(self, key):
+        """Return the file path a video for this key is stored at"""
+        return os.path.join(self.directory, f"{key}.mp4")
+
+    def lookup(self, key):
+        """Return the cached video path for a key, or None"""
+        path = self.path_for(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.isfile(path):
+                # Evicted by the artifact store
+                del self._entries[key]
+                return None
+            entry["last_access"] = self._clock()
+        artifact_store.touch_file(path)
+        return path
+
+    def get_or_create(self, key, produce, progress_callback=None, cancel_event=None):
+        """Return the video for a key, generating it at most once at a time
+
+        Args:
+            key (str): Cache key from make_key
+            produce (callable): Called as produce(dest_path, progress_callback, cancel_event);
+                must write the video to dest_path
+            progress_callback (callable, optional): Called as progress_callback(progress, message)
+            cancel_event (threading.Event, optional): Cancels this request
+
+        Returns:
+            str: Path to the video
+
+        Raises:
+            JobCancelled: If cancel_event was set
+        """
+        while True:
+            path = self.lookup(key)
+            if path is not None:
+                with self._lock:
+                    self.hits += 1
+                metrics.inc("video_cache_requests_total", result="hit")
+                if progress_callback:
+                    progress_callback(1.0, "Reused an identical video")
+                return path
+
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+                if progress_callback:
+                    flight.listeners.append(progress_callback)
+
+            metrics.inc("video_cache_requests_total", result="miss" if leader else "coalesced")
+            if leader:
+                return self._lead(key, flight, produce, cancel_event)
+
+            if progress_callback:
+                progress_callback(None, "Waiting for an identical video already being generated...")
+            while not flight.done.wait(WAIT_POLL_INTERVAL):
+                if cancel_event is not None and cancel_event.is_set():
+                    with self._lock:
+                        if progress_callback in flight.listeners:
+                            flight.listeners.remove(progress_callback)
+                    raise video_jobs.JobCancelled()
+            if flight.path is not None:
+                with self._lock:
+                    self.hits += 1
+                return flight.path
+            if not isinstance(flight.error, video_jobs.JobCancelled):
+                raise flight.error
+            # The leader was cancelled: try again, possibly leading this time
+
+    def _lead(self, key, flight, produce, cancel_event):
+        path = self.path_for(key)
+        try:
+            produce(path, flight.report, cancel_event)
+            size = os.path.getsize(path)
+            with self._lock:
+                self._entries[key] = {"size": size, "last_access": self._clock()}
+            artifact_store.register_file(path)
+            self._enforce_budget(keep=key)
+            flight.path = path
+            return path
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _enforce_budget(self, keep=None):
+        with self._lock:
+            total = sum(entry["size"] for entry in self._entries.values())
+            for key, entry in sorted(self._entries.items(), key=lambda kv: kv[1]["last_access"]):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(self.path_for(key))
+                except FileNotFoundError:
+                    pass
+                del self._entries[key]
+                total -= entry["size"]
+                self.evictions += 1
+
+    def stats(self):
+        """Return cache size and hit/miss/coalesced/eviction counters"""
+        with self._lock:
+            return {
+                "videos": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "in_flight": len(self._flights),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_video_cache():
+    """Return the process-wide video result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            directory = artifact_store.get_artifact_store().session_dir(NAMESPACE)
+            _cache = VideoResultCache(directory)
+        return _cache
@@ -1,27 +1,258 @@
 import os
+import shutil
+import time
 import uuid
-import streamlit as st
-import replicate
-import tempfile
 import requests
 import base64
 from dotenv import load_dotenv
+import artifact_store
+import client_pool
+import file_uploads
+import metrics
+import rate_limit
+import utils
+import video_cache
+import video_jobs
+from image_store import content_hash
 
 # Load environment variables
 load_dotenv()
 
-def generate_video(image_data, prompt, temp_dir):
+IMAGE_TO_VIDEO_MODEL = "wavespeedai/wan-2.1-i2v-480p"
+TEXT_TO_VIDEO_MODEL = "google/veo-3"
+
+# Seconds between status polls of a running prediction
+POLL_INTERVAL = 2
+
+# Streaming download settings for generated videos
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+MAX_RESUME_ATTEMPTS = 3
+
+# Upload input images once through the Replicate Files API instead of inlining
+# them as base64 data URIs (set REPLICATE_UPLOADS=0 to disable)
+USE_REPLICATE_UPLOADS = os.environ.get("REPLICATE_UPLOADS", "1").lower() not in ("0", "false", "no")
+
+# Reuse finished videos for identical requests (set VIDEO_CACHE=0 to disable)
+USE_VIDEO_CACHE = os.environ.get("VIDEO_CACHE", "1").lower() not in ("0", "false", "no")
+
+def _run_prediction(client, model, model_input, progress_callback=None, cancel_event=None):
+    """Run a Replicate prediction, reporting progress and honouring cancellation
+    
+    Args:
+        client (replicate.Client): Authenticated client
+        model (str): Model identifier ("owner/name")
+        model_input (dict): Model input
+        progress_callback (callable, optional): Called as progress_callback(progress, message)
+        cancel_event (threading.Event, optional): When set, the prediction is cancelled
+        
+    Returns:
+        object: The prediction output
+        
+    Raises:
+        JobCancelled: If cancel_event was set
+        Exception: If the prediction failed
+    """
+    # Creating predictions counts against the quota; retry throttling and transient errors
+    with metrics.span("replicate_create", model=model):
+        prediction = rate_limit.call_with_retry(
+            lambda: client.predictions.create(model=model, input=model_input),
+            limiter=rate_limit.get_limiter("replicate", model)
+        )
+    created = time.monotonic()
+    running_since = None
+    
+    while prediction.status not in ("succeeded", "failed", "canceled"):
+        if running_since is None and prediction.status != "starting":
+            running_since = time.monotonic()
+            metrics.observe("replicate_queue_seconds", running_since - created, model=model)
+        if cancel_event is not None and cancel_event.is_set():
+            prediction.cancel()
+            raise video_jobs.JobCancelled()
+        if progress_callback:
+            progress = getattr(prediction, "progress", None)
+            percentage = getattr(progress, "percentage", None) if progress else None
+            status_text = "Waiting in Replicate queue..." if prediction.status == "starting" else "Generating video..."
+            progress_callback(percentage, status_text)
+        time.sleep(POLL_INTERVAL)
+        rate_limit.call_with_retry(prediction.reload)
+    
+    if running_since is None:
+        running_since = time.monotonic()
+        metrics.observe("replicate_queue_seconds", running_since - created, model=model)
+    metrics.observe("replicate_run_seconds", time.monotonic() - running_since, model=model, status=prediction.status)
+    
+    if prediction.status == "canceled":
+        raise video_jobs.JobCancelled()
+    if prediction.status == "failed":
+        raise Exception(f"Replicate API error: {prediction.error}")
+    return prediction.output
+
+def _output_source(output):
+    """Resolve a prediction output (file object, URL or list of them) to one item"""
+    if isinstance(output, (list, tuple)):
+        if not output:
+            raise Exception("Replicate API did not return a valid video URL")
+        output = output[0]
+    # FileOutput objects expose their URL; prefer it so the download can be ranged
+    url = getattr(output, "url", None)
+    if isinstance(url, str) and url.startswith(("http://", "https://")):
+        return url
+    if isinstance(output, str) or hasattr(output, "read") or hasattr(output, "__iter__"):
+        return output
+    raise Exception(f"Replicate API did not return a valid video URL. Received: {type(output)}")
+
+def _stream_url_to_file(url, file, timeout):
+    """Stream a URL into an open file, resuming with ranged reads when possible
+    
+    Returns:
+        int: Number of bytes written
+    """
+    written = 0
+    expected = None
+    for attempt in range(MAX_RESUME_ATTEMPTS + 1):
+        # Ask for identity encoding so Content-Length matches the bytes written
+        headers = {"Accept-Encoding": "identity"}
+        if written:
+            headers["Range"] = f"bytes={written}-"
+        try:
+            with requests.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                response.raise_for_status()
+                if written and response.status_code != 206:
+                    # Server ignored the range: start over
+                    file.seek(0)
+                    file.truncate()
+                    written = 0
+                if expected is None and "Content-Length" in response.headers:
+                    expected = written + int(response.headers["Content-Length"])
+                supports_ranges = response.headers.get("Accept-Ranges") == "bytes" or response.status_code == 206
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    written += len(chunk)
+            if expected is not None and written != expected:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"received {written} of {expected} bytes"
+                )
+            return written
+        except requests.exceptions.RequestException as e:
+            if attempt == MAX_RESUME_ATTEMPTS or not written or not supports_ranges:
+                raise Exception(f"Failed to download video from {url}: {str(e)}")
+    return written
+
+def download_output(output, dest_path, timeout=DOWNLOAD_TIMEOUT):
+    """Stream a prediction output to disk with bounded memory
+    
+    The data is written in chunks to a temporary ".part" file that is
+    renamed into place only once the download is complete and matches the
+    advertised Content-Length. Interrupted URL downloads are resumed with
+    ranged reads when the server supports them.
+    
+    Args:
+        output: Prediction output (URL, file-like object or list of them)
+        dest_path (str): Final path of the file
+        timeout (float, optional): Per-request timeout in seconds
+        
+    Returns:
+        str: dest_path, once the file is finalized
+    """
+    source = _output_source(output)
+    part_path = dest_path + ".part"
+    try:
+        with metrics.span("video_download"), open(part_path, "wb") as file:
+            if isinstance(source, str):
+                _stream_url_to_file(source, file, timeout)
+            elif hasattr(source, "read"):
+                shutil.copyfileobj(source, file, DOWNLOAD_CHUNK_SIZE)
+            else:
+                for chunk in source:
+                    file.write(chunk)
+        os.replace(part_path, dest_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    metrics.inc("video_download_bytes_total", os.path.getsize(dest_path))
+    return dest_path
+
+def _image_input(replicate_api_key, image_data, mime_type, image_hash):
+    """Return the model input value for an image
+    
+    With uploads enabled the image is uploaded once per content hash and
+    later requests send only its URL; otherwise (or if the upload fails) it
+    is sent inline as a data URI.
+    
+    Returns:
+        tuple: (input_value, upload_cache or None)
+    """
+    if USE_REPLICATE_UPLOADS:
+        upload_cache = file_uploads.get_replicate_file_cache(replicate_api_key)
+        try:
+            handle = upload_cache.get_handle(image_data, mime_type, image_hash=image_hash)
+            return handle["uri"], upload_cache
+        except Exception:
+            # Older clients or a failing Files API: fall back to inlining
+            pass
+    image_base64 = base64.b64encode(image_data).decode("utf-8")
+    return f"data:{mime_type};base64,{image_base64}", None
+
+def _produce_video(client, model, model_input, video_path, progress_callback=None, cancel_event=None):
+    """Run a prediction and stream its output video to video_path"""
+    output = _run_prediction(
+        client,
+        model,
+        model_input,
+        progress_callback=progress_callback,
+        cancel_event=cancel_event
+    )
+    
+    # Download the video from the output URL
+    if progress_callback:
+        progress_callback(None, "Downloading video...")
+    download_output(output, video_path)
+
+def _generate(produce, cache_key, temp_dir, file_prefix, progress_callback=None, cancel_event=None):
+    """Produce a video into temp_dir, through the result cache when cache_key is given
+    
+    Returns:
+        str: Path to the video file
+    """
+    video_path = os.path.join(temp_dir, f"{file_prefix}_{uuid.uuid4()}.mp4")
+    if cache_key is not None:
+        cached_path = video_cache.get_video_cache().get_or_create(
+            cache_key, produce, progress_callback=progress_callback, cancel_event=cancel_event
+        )
+        # The shared cache is not served by URL (its names derive from prompts),
+        # so the session gets its own link to the file
+        try:
+            os.link(cached_path, video_path)
+        except OSError:
+            shutil.copyfile(cached_path, video_path)
+    else:
+        produce(video_path, progress_callback, cancel_event)
+    artifact_store.register_file(video_path)
+    return video_path
+
+def generate_video(image_data, prompt, temp_dir, mime_type=None, progress_callback=None, cancel_event=None,
+                   use_cache=USE_VIDEO_CACHE):
     """Generate a video from an image using the WAN-2 model via Replicate
     
+    Identical requests (same model, image bytes and prompt) reuse a finished
+    video, and concurrent identical requests share one prediction.
+    
     Args:
-        image_data (bytes): Binary image data
+        image_data (bytes): Binary image data (ideally the preprocessed model variant)
         prompt (str): Text prompt describing the desired video
-        temp_dir (str): Directory to save the video in
+        temp_dir (str): Directory to save the video in when caching is off
+        mime_type (str, optional): MIME type of image_data; detected from the bytes if omitted
+        progress_callback (callable, optional): Called as progress_callback(progress, message)
+        cancel_event (threading.Event, optional): Set to cancel the running prediction
+        use_cache (bool, optional): Use the video result cache
         
     Returns:
         str: Path to the generated video file
         
     Raises:
+        JobCancelled: If cancel_event was set
         Exception: If video generation fails
     """
     # Get the API key
@@ -29,76 +260,85 @@ def generate_video(image_data, prompt, temp_dir):
     if not replicate_api_key:
         raise Exception("REPLICATE_API_KEY not found in environment variables")
     
-    # Generate a unique filename for the video
-    video_filename = f"video_{uuid.uuid4()}.mp4"
-    video_path = os.path.join(temp_dir, video_filename)
-    
     try:
-        # Convert image data to base64 for API consumption
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
+        # Reuse the pooled, authenticated client
+        client = client_pool.get_replicate_client(replicate_api_key)
         
-        # Create authenticated client
-        client = replicate.Client(api_token=replicate_api_key)
+        image_mime_type = mime_type or utils.detect_mime_type(image_data)
+        image_hash = content_hash(image_data)
         
-        # Call Replicate API to generate the video
-        output = client.run(
-            "wavespeedai/wan-2.1-i2v-480p",
-            input={
-                "image": f"data:image/jpeg;base64,{image_base64}",
-                "prompt": prompt
-            }
-        )
+        def produce(video_path, progress, cancel):
+            # Send an uploaded-file URL (or a data URI) rather than raw bytes
+            image_input, upload_cache = _image_input(replicate_api_key, image_data, image_mime_type, image_hash)
+            try:
+                _produce_video(
+                    client,
+                    IMAGE_TO_VIDEO_MODEL,
+                    {
+                        "image": image_input,
+                        "prompt": prompt
+                    },
+                    video_path,
+                    progress_callback=progress,
+                    cancel_event=cancel
+                )
+            except Exception:
+                # The uploaded file may be gone; upload it again next time
+                if upload_cache is not None:
+                    upload_cache.invalidate([image_hash])
+                raise
         
-        # Download the video from the output URL
-        with open(video_path, "wb") as file:
-            file.write(output.read())
-            
-        return video_path
+        cache_key = video_cache.make_key(IMAGE_TO_VIDEO_MODEL, prompt, image_hash) if use_cache else None
+        return _generate(produce, cache_key, temp_dir, "video", progress_callback, cancel_event)
     
+    except video_jobs.JobCancelled:
+        raise
     except Exception as e:
         raise Exception(f"Video generation failed: {str(e)}")
 
-def generate_video_from_text(prompt, temp_dir):
+def generate_video_from_text(prompt, temp_dir, progress_callback=None, cancel_event=None, use_cache=USE_VIDEO_CACHE):
     """Generate a video from a text prompt using the Google Veo-3 model via Replicate.
 
+    Identical prompts reuse a finished video, and concurrent identical
+    requests share one prediction.
+
     Args:
         prompt (str): Text prompt describing the desired video.
-        temp_dir (str): Directory to save the video in.
+        temp_dir (str): Directory to save the video in when caching is off.
+        progress_callback (callable, optional): Called as progress_callback(progress, message).
+        cancel_event (threading.Event, optional): Set to cancel the running prediction.
+        use_cache (bool, optional): Use the video result cache.
 
     Returns:
         str: Path to the generated video file.
 
     Raises:
+        JobCancelled: If cancel_event was set.
         Exception: If video generation fails.
     """
     replicate_api_key = os.environ.get("REPLICATE_API_KEY")
     if not replicate_api_key:
         raise Exception("REPLICATE_API_KEY not found in environment variables")
 
-    video_filename = f"video_text_{uuid.uuid4()}.mp4"
-    video_path = os.path.join(temp_dir, video_filename)
-
     try:
-        client = replicate.Client(api_token=replicate_api_key)
-
-        # Call Replicate API to generate the video using google/veo-3
-        # This model is expected to return a file-like object directly
-        output = client.run(
-            "google/veo-3",
-            input={"prompt": prompt}
-        )
+        client = client_pool.get_replicate_client(replicate_api_key)
 
-        # Write the video content to the file
-        # Ensure 'output' has a 'read' method as expected for file-like objects from Replicate
-        if not hasattr(output, 'read'):
-            raise Exception(f"Replicate API for google/veo-3 did not return a readable object. Received: {type(output)}")
+        def produce(video_path, progress, cancel):
+            # Call Replicate API to generate the video using google/veo-3
+            _produce_video(
+                client,
+                TEXT_TO_VIDEO_MODEL,
+                {"prompt": prompt},
+                video_path,
+                progress_callback=progress,
+                cancel_event=cancel
+            )
 
-        with open(video_path, "wb") as file:
-            file.write(output.read())
-            
-        return video_path
+        cache_key = video_cache.make_key(TEXT_TO_VIDEO_MODEL, prompt) if use_cache else None
+        return _generate(produce, cache_key, temp_dir, "video_text", progress_callback, cancel_event)
 
-    # Removed requests.exceptions.RequestException as we are no longer making a separate HTTP request for download
+    except video_jobs.JobCancelled:
+        raise
     except Exception as e:
         error_message = str(e)
         # Avoid re-wrapping common or specific errors
@@ -119,9 +359,8 @@ def reset_video_state():
         dict: Reset video generation state
     """
     return {
-        "selected_image_idx": None,
+        "selected_image_name": None,
         "prompt": "",
-        "generating": False,
-        "video_path": None
+        "error_message": None
     } 
 
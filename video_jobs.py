@@ -0,0 +1,268 @@
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Process-wide defaults: at most this many Replicate runs at once in total,
+# and per user (Streamlit session)
+DEFAULT_GLOBAL_LIMIT = int(os.environ.get("VIDEO_JOBS_GLOBAL_LIMIT", "4"))
+DEFAULT_PER_USER_LIMIT = int(os.environ.get("VIDEO_JOBS_PER_USER_LIMIT", "2"))
+DEFAULT_MAX_QUEUED_PER_USER = int(os.environ.get("VIDEO_JOBS_MAX_QUEUED_PER_USER", "10"))
+# Finished jobs are forgotten after this many seconds, and past this many per user
+DEFAULT_FINISHED_TTL = int(os.environ.get("VIDEO_JOBS_FINISHED_TTL", str(60 * 60)))
+DEFAULT_MAX_FINISHED_PER_USER = int(os.environ.get("VIDEO_JOBS_MAX_FINISHED_PER_USER", "20"))
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when its job has been cancelled"""
+
+
+class VideoJob:
+    """A single queued video generation and its status"""
+
+    def __init__(self, owner, kind, label, func, kwargs):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.kind = kind
+        self.label = label
+        self.func = func
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.progress = None
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self):
+        """Return a snapshot of the job that is safe to read from the UI thread"""
+        return {
+            "id": self.id,
+            "owner": self.owner,
+            "kind": self.kind,
+            "label": self.label,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs video generations on background threads
+
+    Jobs are kept by the process, so they survive Streamlit reruns; sessions
+    only hold job ids. A queued job starts once fewer than ``global_limit``
+    jobs are running overall and fewer than ``per_user_limit`` are running
+    for its owner.
+
+    Job functions are called as ``func(progress_callback=..., cancel_event=..., **kwargs)``
+    and return the job result (e.g. a video path).
+
+    A finished job drops its function and arguments (which may hold image
+    bytes) and keeps only its status and result. Finished jobs are forgotten
+    after ``finished_ttl`` seconds, and beyond the newest
+    ``max_finished_per_user`` per owner.
+    """
+
+    def __init__(self, global_limit=DEFAULT_GLOBAL_LIMIT, per_user_limit=DEFAULT_PER_USER_LIMIT,
+                 max_queued_per_user=DEFAULT_MAX_QUEUED_PER_USER, finished_ttl=DEFAULT_FINISHED_TTL,
+                 max_finished_per_user=DEFAULT_MAX_FINISHED_PER_USER):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self.max_queued_per_user = max_queued_per_user
+        self.finished_ttl = finished_ttl
+        self.max_finished_per_user = max_finished_per_user
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = deque()
+        self._running = {}
+        self._thread_names = itertools.count(1)
+
+    def submit(self, owner, kind, func, label="", **kwargs):
+        """Queue a job
+
+        Args:
+            owner (str): Id of the submitting user/session
+            kind (str): Job type, e.g. "image_to_video"
+            func (callable): Job function
+            label (str, optional): Short description shown in the UI
+            **kwargs: Arguments passed to func
+
+        Returns:
+            str: Job id
+
+        Raises:
+            Exception: If the owner already has too many unfinished jobs
+        """
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job.owner == owner and job.active)
+            if active >= self.max_queued_per_user:
+                raise Exception(f"Too many video jobs in progress ({active}). Wait for one to finish or cancel it.")
+            job = VideoJob(owner, kind, label, func, kwargs)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._dispatch()
+        return job.id
+
+    def _dispatch(self):
+        """Start every pending job allowed by the limits; caller must hold the lock"""
+        if len(self._running) >= self.global_limit:
+            return
+        per_owner = {}
+        for job in self._running.values():
+            per_owner[job.owner] = per_owner.get(job.owner, 0) + 1
+        for job in list(self._pending):
+            if len(self._running) >= self.global_limit:
+                break
+            if per_owner.get(job.owner, 0) >= self.per_user_limit:
+                continue
+            self._pending.remove(job)
+            per_owner[job.owner] = per_owner.get(job.owner, 0) + 1
+            self._running[job.id] = job
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.message = "Starting..."
+            thread = threading.Thread(
+                target=self._run,
+                args=(job,),
+                name=f"video-job-{next(self._thread_names)}",
+                daemon=True,
+            )
+            thread.start()
+
+    def _run(self, job):
+        def progress_callback(progress=None, message=None):
+            if progress is not None:
+                job.progress = max(0.0, min(1.0, progress))
+            if message is not None:
+                job.message = message
+
+        try:
+            result = job.func(progress_callback=progress_callback, cancel_event=job.cancel_event, **job.kwargs)
+            status, job.result, job.message = SUCCEEDED, result, "Done"
+            job.progress = 1.0
+        except JobCancelled:
+            status, job.message = CANCELLED, "Cancelled"
+        except Exception as e:
+            if job.cancel_event.is_set():
+                status, job.message = CANCELLED, "Cancelled"
+            else:
+                status, job.error, job.message = FAILED, str(e), "Failed"
+        with self._lock:
+            self._finish(job, status)
+            self._running.pop(job.id, None)
+            self._dispatch()
+
+    def _finish(self, job, status):
+        """Mark a job finished and release its arguments; caller must hold the lock"""
+        job.status = status
+        job.finished_at = time.time()
+        job.func = None
+        job.kwargs = None
+
+    def _prune(self):
+        """Forget expired finished jobs and the oldest beyond the per-owner cap; caller must hold the lock"""
+        now = time.time()
+        finished = {}
+        for job in sorted(self._jobs.values(), key=lambda j: j.finished_at or 0, reverse=True):
+            if job.active:
+                continue
+            kept = finished.setdefault(job.owner, 0)
+            if now - job.finished_at > self.finished_ttl or kept >= self.max_finished_per_user:
+                del self._jobs[job.id]
+            else:
+                finished[job.owner] = kept + 1
+
+    def get(self, job_id):
+        """Return a snapshot dict of a job, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list_jobs(self, owner=None):
+        """Return snapshot dicts of all jobs, or only those of one owner, oldest first"""
+        with self._lock:
+            self._prune()
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+            return [job.to_dict() for job in sorted(jobs, key=lambda j: j.created_at)]
+
+    def cancel(self, job_id):
+        """Cancel a job
+
+        Queued jobs are cancelled immediately; running jobs are signalled and
+        stop at their next cancellation check.
+
+        Returns:
+            bool: True if the job was still active
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._pending.remove(job)
+                self._finish(job, CANCELLED)
+                job.message = "Cancelled"
+            else:
+                job.message = "Cancelling..."
+            return True
+
+    def remove(self, job_id):
+        """Forget a finished job
+
+        Returns:
+            bool: True if the job was removed
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.active:
+                return False
+            del self._jobs[job_id]
+            return True
+
+    def stats(self):
+        """Return counts of jobs per status and the configured limits"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "jobs": counts,
+                "running": len(self._running),
+                "queued": len(self._pending),
+                "global_limit": self.global_limit,
+                "per_user_limit": self.per_user_limit,
+            }
+
+
+# Process-wide manager shared by every Streamlit session
+_manager = JobManager()
+
+
+def get_job_manager():
+    """Return the process-wide video job manager"""
+    return _manager